@@ -1,29 +1,84 @@
-from flask import Flask, jsonify, make_response, request, url_for
-from flask_migrate import Migrate
+from flask import Flask, Response, g, jsonify, make_response, request, stream_with_context, url_for
 from flask_restful import Api, Resource
-from flask_bcrypt import Bcrypt
+from sqlalchemy import update
 from sqlalchemy.exc import IntegrityError
-from waitress import serve
+from sqlalchemy.orm.exc import StaleDataError
 from flask_cors import CORS
-
-
-from models import db, UserModel, ProductModel, cartModel, cartItemModel, OrderModel, OrderItemModel, ReviewModel
+import os
+import json
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+
+from models import db, live, get_bcrypt, UserModel, ProductModel, cartModel, cartItemModel, OrderModel, OrderItemModel, ReviewModel, JobModel, PurgeModel
+from jobs import enqueue, WorkerPool
+from changes import changes_since, latest_seq, log_change, wait_for_changes
+import readmodels
+import archive
+import recommendations
+import batch
+import inventory
+# registers the purge job handler
+import purge
+from inventory import OutOfStock
+from schemas import decode, to_dict, UserBody, LoginBody, RefreshBody, LogoutBody, ProductBody, CartBody, CartItemBody, OrderBody, OrderItemBody, QuantityBody, ReviewBody, ReviewUpdateBody, BatchBody
+from routing import router
+from sharding import store, StaleRow
+from auth import tokens, token_required, admin_required, InvalidToken, REFRESH
+from maintenance import maintenance
 
 # create a Flask application object
 app = Flask(__name__)
 
 # configure a database connection to the local file app.db
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///data.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///data.db')
+
+# optional read replicas for GET traffic, see routing.py
+replica_urls = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+app.config['SQLALCHEMY_BINDS'] = {'replica_%d' % n: url for n, url in enumerate(replica_urls)}
+app.config['SQLALCHEMY_REPLICAS'] = list(app.config['SQLALCHEMY_BINDS'])
+
+# optional shards for user-owned rows, see sharding.py
+shard_urls = [url.strip() for url in os.environ.get('DATABASE_SHARD_URLS', '').split(',') if url.strip()]
+app.config['SQLALCHEMY_BINDS'].update({'shard_%d' % n: url for n, url in enumerate(shard_urls)})
+app.config['SQLALCHEMY_SHARDS'] = ['shard_%d' % n for n in range(len(shard_urls))]
+
+# cold storage for archived orders, see archive.py
+app.config['SQLALCHEMY_BINDS'][archive.ARCHIVE_BIND] = os.environ.get('ARCHIVE_DATABASE_URL', 'sqlite:///archive.db')
 
 # disable modification tracking to use less memory
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# signs the bearer tokens issued by /login, see auth.py
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+app.config['ACCESS_TOKEN_SECONDS'] = int(os.environ.get('ACCESS_TOKEN_SECONDS', 15 * 60))
+# user ids allowed on /admin/* and the user list, comma separated
+app.config['ADMIN_USER_IDS'] = [int(n) for n in os.environ.get('ADMIN_USER_IDS', '').split(',') if n.strip()]
+
+# /changes long-polls and SSE streams that may hold a thread at once; waitress
+# gets this many threads on top of API_THREADS, so waiting consumers never
+# take the threads the rest of the API runs on
+API_THREADS = 4
+app.config['CHANGE_FEED_WAITERS'] = int(os.environ.get('CHANGE_FEED_WAITERS', 8))
+
+# where maintenance.py writes its hot backups, default instance/backups
+app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR')
+
 # Initialize extensions
 db.init_app(app)
-migrate = Migrate(app, db)
-bcrypt = Bcrypt(app)
+router.init_app(app, db)
+store.init_app(app, db)
+tokens.init_app(app)
+maintenance.init_app(app, db)
 api = Api(app)
 
+# migration tooling is only needed by `flask db ...` and friends
+if os.environ.get("FLASK_RUN_FROM_CLI") == "true":
+    from flask_migrate import Migrate
+    migrate = Migrate(app, db)
+
 CORS(app)
 
 @app.shell_context_processor
@@ -32,6 +87,267 @@ def make_shell_context():
 
 
 
+# optimistic concurrency: versioned models are exposed as ETags and
+# PUT/DELETE must name the version they were based on via If-Match
+def etag(obj):
+    return '"%s-%s"' % (obj.id, obj.version_id)
+
+def check_if_match(obj):
+    if_match = request.headers.get("If-Match")
+    if not if_match:
+        return {"error": "If-Match header required"}, 428
+    # If-Match uses the strong comparison (RFC 7232 3.1): weak tags never match
+    tags = [tag.strip() for tag in if_match.split(",")]
+    if "*" not in tags and etag(obj) not in tags:
+        return {"error": "Resource has been modified"}, 412, {"ETag": etag(obj)}
+    return None
+
+def flush_versioned():
+    # a concurrent writer bumped the version after our If-Match check; the
+    # version guard runs at flush, so callers can flush first to get ids
+    # (for an enqueued job's payload) before they commit
+    try:
+        db.session.flush()
+    except StaleDataError:
+        db.session.rollback()
+        return {"error": "Resource has been modified"}, 412
+    return None
+
+def commit_versioned():
+    conflict = flush_versioned()
+    if conflict:
+        return conflict
+    db.session.commit()
+    return None
+
+def check_live(user_id=None, product_id=None):
+    # 404 when the user or product a new row points at is gone or tombstoned
+    if user_id is not None and not live(UserModel, user_id):
+        return {"error": "User not found"}, 404
+    if product_id is not None and not live(ProductModel, product_id):
+        return {"error": "Product not found"}, 404
+    return None
+
+# DELETE of a user or product answers 202 and leaves the work to purge.py
+def purge_accepted(label, purge):
+    body = {"message": "%s deleted; related data is being removed" % label, "purge": purge.to_dict()}
+    return body, 202, {"Location": "/admin/purges/%d" % purge.id}
+
+def sharded_response(row, status=200):
+    row = SimpleNamespace(**row)
+    body = vars(row).copy()
+    # not exposed by the models' to_dict() either
+    body.pop("created_at", None)
+    headers = {}
+    if body.pop("version_id", None) is not None:
+        headers["ETag"] = etag(row)
+    return body, status, headers
+
+def sharded_stock_write(stock, write):
+    """Run a shard write that takes `stock` = (product id, units) off the shelf.
+
+    Stock lives on the primary. Units the write takes are reserved and
+    committed before it and handed back if it does not go through; units it
+    frees (negative) are released once it has.
+    """
+    product_id, units = stock or (None, 0)
+    if units > 0:
+        try:
+            inventory.reserve(product_id, units)
+        except OutOfStock:
+            db.session.rollback()
+            return {"error": "Insufficient stock"}, 409
+        db.session.commit()
+    try:
+        response = write()
+    except Exception:
+        if units > 0:
+            inventory.release(product_id, units)
+            db.session.commit()
+        raise
+    done = response[1] in (200, 201)
+    if (units > 0 and not done) or (units < 0 and done):
+        inventory.release(product_id, abs(units))
+        db.session.commit()
+    return response
+
+# sharded variants of the user-owned resources, registered instead of the
+# ORM ones when DATABASE_SHARD_URLS is set
+class ShardedListResource(Resource):
+    table = None
+    schema = None
+
+    def get(self):
+        return [sharded_response(row)[0] for row in store.scatter_gather(self.table)], 200
+
+    def post(self):
+        body = decode(self.schema)
+        missing = check_live(getattr(body, "user_id", None), getattr(body, "product_id", None))
+        if missing:
+            return missing
+        row = store.insert(self.table, to_dict(body))
+        return sharded_response(row, 201)
+
+class ShardedItemResource(Resource):
+    table = None
+    label = None
+    schema = QuantityBody
+    # child table whose rows are deleted along with a row
+    children = None
+
+    def adjustment(self, row, values):
+        # parent-row deltas to apply with this update (values None on delete)
+        return None
+
+    def stock(self, row, values):
+        # (product id, units taken) by this update (values None on delete)
+        return None
+
+    def released(self, children):
+        # (product id, units) pairs held by child rows deleted with a row
+        return []
+
+    def get(self, **ids):
+        row = store.get(self.table, *ids.values())
+        if not row:
+            return {"error": "%s not found" % self.label}, 404
+        return sharded_response(row)
+
+    def put(self, **ids):
+        values = to_dict(decode(self.schema))
+        row_id, = ids.values()
+        row = store.get(self.table, row_id)
+        if not row:
+            return {"error": "%s not found" % self.label}, 404
+        version = row.get("version_id")
+        if version is not None:
+            precondition = check_if_match(SimpleNamespace(**row))
+            if precondition:
+                return precondition
+
+        def write():
+            try:
+                updated = store.update(self.table, row_id, values, version, adjust=self.adjustment(row, values))
+            except StaleRow:
+                return {"error": "Resource has been modified"}, 412
+            if not updated:
+                return {"error": "%s not found" % self.label}, 404
+            return sharded_response(updated)
+        return sharded_stock_write(self.stock(row, values), write)
+
+    def delete(self, **ids):
+        row_id, = ids.values()
+        row = store.get(self.table, row_id)
+        if not row:
+            return {"error": "%s not found" % self.label}, 404
+        version = row.get("version_id")
+        if version is not None:
+            precondition = check_if_match(SimpleNamespace(**row))
+            if precondition:
+                return precondition
+
+        def write():
+            try:
+                removed = store.delete(self.table, row_id, version, adjust=self.adjustment(row, None), children=self.children)
+            except StaleRow:
+                return {"error": "Resource has been modified"}, 412
+            if removed:
+                for product_id, units in self.released(removed):
+                    inventory.release(product_id, units)
+                db.session.commit()
+            return {"message": "%s deleted successfully" % self.label}, 200
+        return sharded_stock_write(self.stock(row, None), write)
+
+class ShardedCartResource(ShardedListResource):
+    table = "cart"
+    schema = CartBody
+
+class ShardedCartByIdResource(ShardedItemResource):
+    table = "cart"
+    label = "Cart"
+
+class ShardedCartItemResource(ShardedListResource):
+    table = "cart_item"
+    schema = CartItemBody
+
+class ShardedCartItemByIdResource(ShardedItemResource):
+    table = "cart_item"
+    label = "Cart item"
+
+class ShardedOrderResource(ShardedListResource):
+    table = "order"
+    schema = OrderBody
+
+    def post(self):
+        body = decode(self.schema)
+        missing = check_live(body.user_id, body.product_id)
+        if missing:
+            return missing
+        response = sharded_stock_write((body.product_id, body.quantity), super().post)
+        if response[1] == 201:
+            # the order row is already committed on its shard
+            enqueue('order_confirmation', order_id=response[0]["id"])
+            db.session.commit()
+        return response
+
+def stock_delta(row, values):
+    # units an order or order item update takes (values None on delete)
+    quantity = values["quantity"] if values else 0
+    return (row["product_id"], quantity - row["quantity"])
+
+class ShardedOrderByIdResource(ShardedItemResource):
+    table = "order"
+    label = "Order"
+    children = "order_item"
+
+    def released(self, children):
+        return [(item["product_id"], item["quantity"]) for item in children]
+
+    def stock(self, row, values):
+        return stock_delta(row, values)
+
+def order_totals_delta(order_id, quantity, unit_price):
+    return ("order", order_id, {"item_count": quantity, "total": quantity * (unit_price or 0)})
+
+class ShardedOrderItemResource(ShardedListResource):
+    table = "order_item"
+    schema = OrderItemBody
+
+    def post(self):
+        body = decode(self.schema)
+        product = live(ProductModel, body.product_id)
+        if not product:
+            return {"error": "Product not found"}, 404
+        if not store.get("order", body.order_id):
+            return {"error": "Order not found"}, 404
+        values = to_dict(body)
+        values["unit_price"] = product.price
+        totals = order_totals_delta(body.order_id, body.quantity, product.price)
+
+        def write():
+            return sharded_response(store.insert(self.table, values, adjust=totals), 201)
+        return sharded_stock_write((body.product_id, body.quantity), write)
+
+class ShardedOrderItemByIdResource(ShardedItemResource):
+    table = "order_item"
+    label = "Order item"
+
+    def adjustment(self, row, values):
+        quantity = values["quantity"] if values else 0
+        return order_totals_delta(row["order_id"], quantity - row["quantity"], row["unit_price"])
+
+    def stock(self, row, values):
+        return stock_delta(row, values)
+
+class ShardedReviewResource(ShardedListResource):
+    table = "review"
+    schema = ReviewBody
+
+class ShardedReviewByIdResource(ShardedItemResource):
+    table = "review"
+    label = "Review"
+    schema = ReviewUpdateBody
+
 #resource class
 class Home(Resource):
     def get(self):
@@ -41,28 +357,48 @@ class Home(Resource):
         return response_dict, 200
 
 api.add_resource(Home, '/')
+
+#liveness: the process is up and serving requests
+class HealthResource(Resource):
+    def get(self):
+        return {"status": "ok"}, 200
+
+api.add_resource(HealthResource, '/healthz')
+
+#readiness: the database answers and the read path is warm
+class ReadyResource(Resource):
+    warmed = False
+
+    def get(self):
+        try:
+            db.session.execute(db.text("SELECT 1"))
+            if not ReadyResource.warmed:
+                readmodels.warm()
+                ReadyResource.warmed = True
+        except Exception as exc:
+            db.session.rollback()
+            return {"status": "unavailable", "error": str(exc)}, 503
+        return {"status": "ready", "replicas": router.status()}, 200
+
+api.add_resource(ReadyResource, '/readyz')
 #User resource class
 class UserResource(Resource):
+    # signing up stays open; the list with everyone's email is for admins
+    method_decorators = {"get": [admin_required]}
+
     #create user in database
     def post(self):
-        data = request.get_json()
-
-        if not data or not all(key in data for key in ("username", "email", "password")):
-            return {"error": "Missing required fields"}, 400
-
-        username = data["username"]
-        email = data["email"]
-        password = data["password"]
+        body = decode(UserBody)
+        username = body.username
+        email = body.email
+        password = body.password
 
         # Check if the user already exists
         if UserModel.query.filter((UserModel.username == username) | (UserModel.email == email)).first():
             return {"error": "User with this username or email already exists"}, 400
 
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
-        new_user = UserModel(username=username, email=email, password=hashed_password)
-
-        db.session.add(new_user)
-        db.session.commit()
+        # the model hashes the password
+        new_user = UserModel(username=username, email=email, password=password)
 
         try:
             db.session.add(new_user)
@@ -75,65 +411,129 @@ class UserResource(Resource):
         return new_user.to_dict(), 201
     #get all users
     def get(self):
-        users = UserModel.query.all()
+        users = UserModel.query.filter(UserModel.deleted_at.is_(None)).all()
         return[user.to_dict() for user in users], 200
 api.add_resource(UserResource, '/users')  
 
 class UserResourceById(Resource):
+    method_decorators = [token_required]
+
     #get user by id
     def get(self, user_id):
-        user = UserModel.query.get(user_id)
+        if g.token["sub"] != user_id:
+            return {"error": "Not allowed"}, 403
+        user = live(UserModel, user_id)
         if not user:
             return {"error": "User not found"}, 404
         return user.to_dict(), 200
     #update user
     def put(self, user_id):
-        data = request.get_json()
-        if not data or not all(key in data for key in ("username", "email", "password")):
-            return {"error": "Missing required fields"}, 400
-        user = UserModel.query.get(user_id)
+        body = decode(UserBody)
+        if g.token["sub"] != user_id:
+            return {"error": "Not allowed"}, 403
+        user = live(UserModel, user_id)
         if not user:
             return {"error": "User not found"}, 404
-        user.username = data["username"]
-        user.email = data["email"]
-        user.password = data["password"]
+        user.username = body.username
+        user.email = body.email
+        password_changed = not user.check_password(body.password)
+        if password_changed:
+            user.set_password(body.password)
         db.session.commit()
+        if password_changed:
+            # sessions opened with the old password end here
+            tokens.revoke_user(user_id)
         return user.to_dict(), 200
     
-    #delete user 
+    #delete user: tombstone now, purge.py removes the row and its data
     def delete(self, user_id):
-        user = UserModel.query.get(user_id)
+        if g.token["sub"] != user_id:
+            return {"error": "Not allowed"}, 403
+        user = live(UserModel, user_id)
         if not user:
             return {"error": "User not found"}, 404
 
-        db.session.delete(user)
+        user.deleted_at = datetime.utcnow()
+        purge = PurgeModel("user", user_id)
+        db.session.add(purge)
+        db.session.flush()
+        enqueue('purge', purge_id=purge.id)
         db.session.commit()
+        tokens.revoke_user(user_id)
 
-        return {"message": "User deleted successfully"}, 200
+        return purge_accepted("User", purge)
     
 api.add_resource(UserResourceById, '/users/<int:user_id>')   
 
+# hashed once, so a login for an unknown user costs as much as a wrong password
+_unknown_user_hash = None
+
+def check_login(login, password):
+    global _unknown_user_hash
+    user = UserModel.query.filter((UserModel.username == login) | (UserModel.email == login), UserModel.deleted_at.is_(None)).first()
+    if user is None:
+        if _unknown_user_hash is None:
+            _unknown_user_hash = get_bcrypt().generate_password_hash(os.urandom(16).hex()).decode('utf-8')
+        get_bcrypt().check_password_hash(_unknown_user_hash, password)
+        return None
+    return user if user.check_password(password) else None
+
+class LoginResource(Resource):
+    # Exchange a username (or email) and password for tokens
+    def post(self):
+        body = decode(LoginBody)
+        login = body.username or body.email
+        if not login:
+            return {"error": "Invalid request body", "field": "username", "detail": "Missing required field"}, 400
+        user = check_login(login, body.password)
+        if not user:
+            return {"error": "Invalid credentials"}, 401
+        return tokens.issue_pair(user.id), 200
+
+api.add_resource(LoginResource, '/login')
+
+class TokenRefreshResource(Resource):
+    # Trade a refresh token for a new pair; the old refresh token is spent
+    def post(self):
+        body = decode(RefreshBody)
+        try:
+            claims = tokens.verify(body.refresh_token, REFRESH)
+        except InvalidToken as error:
+            return {"error": str(error)}, 401
+        tokens.revoke(claims)
+        return tokens.issue_pair(claims["sub"]), 200
+
+api.add_resource(TokenRefreshResource, '/token/refresh')
+
+class LogoutResource(Resource):
+    method_decorators = [token_required]
+
+    # Revoke the access token, and the refresh token if one is sent
+    def post(self):
+        tokens.revoke(g.token)
+        body = decode(LogoutBody, request.get_data() or b"{}")
+        if body.refresh_token:
+            try:
+                claims = tokens.verify(body.refresh_token, REFRESH)
+            except InvalidToken:
+                claims = None
+            if claims and claims["sub"] == g.token["sub"]:
+                tokens.revoke(claims)
+        return {"message": "Logged out"}, 200
+
+api.add_resource(LogoutResource, '/logout')
+
 #Product resource class
 class ProductResource(Resource):
     #get all products
     def get(self):
-        products = ProductModel.query.all()
+        products = readmodels.list_products()
         return [product.to_dict() for product in products], 200
 
     #create product
     def post(self):
-        data = request.get_json()
-        if not data or not all(key in data for key in ("name", "price", "stock")):
-            return {"error": "Missing required fields"}, 400
-
-        name = data["name"]
-        price = data["price"]
-        stock = data["stock"]
-
-        if price < 0 or stock < 0:
-            return {"error": "Price and stock must be non-negative"}, 400
-
-        new_product = ProductModel(name=name, price=price, stock=stock)
+        body = decode(ProductBody)
+        new_product = ProductModel(name=body.name, price=body.price, stock=body.stock)
         try:
             db.session.add(new_product)
             db.session.commit()
@@ -141,76 +541,99 @@ class ProductResource(Resource):
             db.session.rollback()
             return {"error": "Product already exists"}, 400
 
-        return new_product.to_dict(), 201
-
-    #update product
-    def put(self, product_id):
-        data = request.get_json()
-        if not data or not all(key in data for key in ("name", "price", "stock")):
-            return {"error": "Missing required fields"}, 400
-        product = ProductModel.query.get(product_id)
-        if not product:
-            return {"error": "Product not found"}, 404
-        product.name = data["name"]
-        product.price = data["price"]
-        product.stock = data["stock"]
-        db.session.commit()
-        return product.to_dict(), 200
+        return new_product.to_dict(), 201, {"ETag": etag(new_product)}
 
-    #delete product
-    def delete(self, product_id):
-        product = ProductModel.query.get(product_id)
-        if not product:
-            return {"error": "Product not found"}, 404
-        db.session.delete(product)
-        db.session.commit()
-        return {"message": "Product deleted successfully"}, 200
-    
 api.add_resource(ProductResource,'/products')
 
 class ProductResourceById(Resource):
     
     #get product by id
     def get(self, product_id):
-        product = ProductModel.query.get(product_id)
+        product = live(ProductModel, product_id)
         if not product:
             return {"error": "Product not found"}, 404
-        return product.to_dict(), 200
+        return product.to_dict(), 200, {"ETag": etag(product)}
 
-    #delete product by id
+    #update product by id
+    def put(self, product_id):
+        body = decode(ProductBody)
+        product = live(ProductModel, product_id)
+        if not product:
+            return {"error": "Product not found"}, 404
+        precondition = check_if_match(product)
+        if precondition:
+            return precondition
+        product.name = body.name
+        product.price = body.price
+        inventory.set_stock(product, body.stock)
+        conflict = commit_versioned()
+        if conflict:
+            return conflict
+        return product.to_dict(), 200, {"ETag": etag(product)}
+
+    #delete product by id: tombstone now, purge.py removes the row and its data
     def delete(self, product_id):
-        product = ProductModel.query.get(product_id)
+        product = live(ProductModel, product_id)
         if not product:
             return {"error": "Product not found"}, 404
-        db.session.delete(product)
+        precondition = check_if_match(product)
+        if precondition:
+            return precondition
+        product.deleted_at = datetime.utcnow()
+        # nothing more can be ordered while the purge runs
+        inventory.set_stock(product, 0)
+        purge = PurgeModel("product", product_id)
+        db.session.add(purge)
+        conflict = flush_versioned()
+        if conflict:
+            return conflict
+        enqueue('purge', purge_id=purge.id)
         db.session.commit()
-        return {"message": "Product deleted successfully"}, 200
+        return purge_accepted("Product", purge)
 
 api.add_resource(ProductResourceById,'/products/<int:product_id>')
 
+class ProductRecommendationResource(Resource):
+    # Get products frequently bought together with this one, see recommendations.py
+    def get(self, product_id):
+        limit = min(request.args.get("limit", recommendations.TOP_K, type=int), recommendations.TOP_K)
+        if not live(ProductModel, product_id):
+            return {"error": "Product not found"}, 404
+        rows = recommendations.recommendations_for(product_id, limit)
+        return [{"id": id, "name": name, "price": price, "score": score} for id, name, price, score in rows], 200
+
+api.add_resource(ProductRecommendationResource, '/products/<int:product_id>/recommendations')
+
+class ProductStockResource(Resource):
+    # Get the cached stock total, or the exact sum of the slots with ?exact=1, see inventory.py
+    def get(self, product_id):
+        product = live(ProductModel, product_id)
+        if not product:
+            return {"error": "Product not found"}, 404
+        stock = product.available if request.args.get("exact") else product.stock
+        return {"id": product.id, "stock": stock}, 200
+
+api.add_resource(ProductStockResource, '/products/<int:product_id>/stock')
+
 #Cart resource class
 class CartResource(Resource):
     #create cart
     def post(self):
-        data = request.get_json()
-        if not data or not all(key in data for key in ("user_id", "product_id", "quantity")):
-            return {"error": "Missing required fields"}, 400
-
-        quantity = data["quantity"]
-        if quantity <= 0:
-            return {"error": "Quantity must be greater than zero"}, 400
-
-        new_cart = cartModel(user_id=data["user_id"], product_id=data["product_id"], quantity=quantity)
+        body = decode(CartBody)
+        missing = check_live(body.user_id, body.product_id)
+        if missing:
+            return missing
+        new_cart = cartModel(user_id=body.user_id, product_id=body.product_id, quantity=body.quantity)
         db.session.add(new_cart)
         db.session.commit()
 
-        return new_cart.to_dict(), 201
+        return new_cart.to_dict(), 201, {"ETag": etag(new_cart)}
     #get all carts
     def get(self):
         carts = cartModel.query.all()
         return [cart.to_dict() for cart in carts], 200
     
-api.add_resource(CartResource,'/carts')    
+api.add_resource(ShardedCartResource if store.enabled else CartResource,'/carts')
 
 class CartResourceById(Resource):    
     #get cart by id
@@ -218,36 +641,39 @@ class CartResourceById(Resource):
         cart = cartModel.query.get(cart_id)
         if not cart:
             return {"error": "Cart not found"}, 404
-        return cart.to_dict(), 200
+        return cart.to_dict(), 200, {"ETag": etag(cart)}
 
     #update cart
     def put(self, cart_id):
-        data = request.get_json()
-        if not data or "quantity" not in data:
-            return {"error": "Missing required fields"}, 400
-
+        body = decode(QuantityBody)
         cart = cartModel.query.get(cart_id)
         if not cart:
             return {"error": "Cart not found"}, 404
+        precondition = check_if_match(cart)
+        if precondition:
+            return precondition
 
-        quantity = data["quantity"]
-        if quantity <= 0:
-            return {"error": "Quantity must be greater than zero"}, 400
-
-        cart.quantity = quantity
-        db.session.commit()
-        return cart.to_dict(), 200
+        cart.quantity = body.quantity
+        conflict = commit_versioned()
+        if conflict:
+            return conflict
+        return cart.to_dict(), 200, {"ETag": etag(cart)}
 
     #delete cart
     def delete(self, cart_id):
         cart = cartModel.query.get(cart_id)
         if not cart:
             return {"error": "Cart not found"}, 404
+        precondition = check_if_match(cart)
+        if precondition:
+            return precondition
         db.session.delete(cart)
-        db.session.commit()
+        conflict = commit_versioned()
+        if conflict:
+            return conflict
         return {"message": "Cart deleted successfully"}, 200
 
-api.add_resource(CartResourceById, '/carts/<int:cart_id>')
+api.add_resource(ShardedCartByIdResource if store.enabled else CartResourceById, '/carts/<int:cart_id>')
 
 #CartItem resource class
 class CartItemResource(Resource):
@@ -258,21 +684,17 @@ class CartItemResource(Resource):
 
     # Add a new cart item
     def post(self):
-        data = request.get_json()
-        if not data or not all(key in data for key in ("cart_id", "product_id", "quantity")):
-            return {"error": "Missing required fields"}, 400
-
-        quantity = data["quantity"]
-        if quantity <= 0:
-            return {"error": "Quantity must be greater than zero"}, 400
-
-        new_cart_item = cartItemModel(cart_id=data["cart_id"], product_id=data["product_id"], quantity=quantity)
+        body = decode(CartItemBody)
+        missing = check_live(product_id=body.product_id)
+        if missing:
+            return missing
+        new_cart_item = cartItemModel(cart_id=body.cart_id, product_id=body.product_id, quantity=body.quantity)
         db.session.add(new_cart_item)
         db.session.commit()
 
         return new_cart_item.to_dict(), 201
 
-api.add_resource(CartItemResource,'/cart_items')
+api.add_resource(ShardedCartItemResource if store.enabled else CartItemResource,'/cart_items')
 
 # Separate resource for handling individual cart items by ID
 class CartItemByIdResource(Resource):
@@ -283,31 +705,14 @@ class CartItemByIdResource(Resource):
             return {"error": "Cart item not found"}, 404
         return cart_item.to_dict(), 200
     
-    #add cart item
-    def post(self):
-        data = request.get_json()
-        if not data or not all(key in data for key in ("cart_id", "product_id", "quantity")):
-            return {"error": "Missing required fields"}, 400
-        new_cart_item = cartItemModel(cart_id=data["cart_id"], product_id=data["product_id"], quantity=data["quantity"])
-        db.session.add(new_cart_item)
-        db.session.commit()
-        return new_cart_item.to_dict(), 201
-
     #update cart item
     def put(self, cart_item_id):
-        data = request.get_json()
-        if not data or "quantity" not in data:
-            return {"error": "Missing required fields"}, 400
-
+        body = decode(QuantityBody)
         cart_item = cartItemModel.query.get(cart_item_id)
         if not cart_item:
             return {"error": "Cart item not found"}, 404
 
-        quantity = data["quantity"]
-        if quantity <= 0:
-            return {"error": "Quantity must be greater than zero"}, 400
-
-        cart_item.quantity = quantity
+        cart_item.quantity = body.quantity
         db.session.commit()
         return cart_item.to_dict(), 200
 
@@ -320,33 +725,36 @@ class CartItemByIdResource(Resource):
         db.session.commit()
         return {"message": "Cart item deleted successfully"}, 200
     
-api.add_resource(CartItemByIdResource, '/cart_items/<int:cart_item_id>')  
+api.add_resource(ShardedCartItemByIdResource if store.enabled else CartItemByIdResource, '/cart_items/<int:cart_item_id>')
 
 
 # Order resource class
 class OrderResource(Resource):
     # Get all orders
     def get(self):
-        orders = OrderModel.query.all()
+        orders = archive.list_orders()
         return [order.to_dict() for order in orders], 200
 
     # Create an order
     def post(self):
-        data = request.get_json()
-        if not data or not all(key in data for key in ("user_id", "product_id", "quantity")):
-            return {"error": "Missing required fields"}, 400
-
-        quantity = data["quantity"]
-        if quantity <= 0:
-            return {"error": "Quantity must be greater than zero"}, 400
-
-        new_order = OrderModel(user_id=data["user_id"], product_id=data["product_id"], quantity=quantity)
+        body = decode(OrderBody)
+        missing = check_live(body.user_id, body.product_id)
+        if missing:
+            return missing
+        try:
+            inventory.reserve(body.product_id, body.quantity)
+        except OutOfStock:
+            db.session.rollback()
+            return {"error": "Insufficient stock"}, 409
+        new_order = OrderModel(user_id=body.user_id, product_id=body.product_id, quantity=body.quantity)
         db.session.add(new_order)
+        db.session.flush()
+        enqueue('order_confirmation', order_id=new_order.id)
         db.session.commit()
 
-        return new_order.to_dict(), 201
+        return new_order.to_dict(), 201, {"ETag": etag(new_order)}
 
-api.add_resource(OrderResource,'/orders')
+api.add_resource(ShardedOrderResource if store.enabled else OrderResource,'/orders')
 
 # Separate resource for handling individual orders by ID
 class OrderByIdResource(Resource):
@@ -354,26 +762,32 @@ class OrderByIdResource(Resource):
     def get(self, order_id):
         order = OrderModel.query.get(order_id)
         if not order:
+            archived = archive.get_order(order_id)
+            if archived:
+                return archived.to_dict(), 200
             return {"error": "Order not found"}, 404
-        return order.to_dict(), 200
+        return order.to_dict(), 200, {"ETag": etag(order)}
 
     # Update order
     def put(self, order_id):
-        data = request.get_json()
-        if not data or "quantity" not in data:
-            return {"error": "Missing required fields"}, 400
-
+        body = decode(QuantityBody)
         order = OrderModel.query.get(order_id)
         if not order:
             return {"error": "Order not found"}, 404
+        precondition = check_if_match(order)
+        if precondition:
+            return precondition
 
-        quantity = data["quantity"]
-        if quantity <= 0:
-            return {"error": "Quantity must be greater than zero"}, 400
-
-        order.quantity = quantity
-        db.session.commit()
-        return order.to_dict(), 200
+        try:
+            inventory.adjust(order.product_id, body.quantity - order.quantity)
+        except OutOfStock:
+            db.session.rollback()
+            return {"error": "Insufficient stock"}, 409
+        order.quantity = body.quantity
+        conflict = commit_versioned()
+        if conflict:
+            return conflict
+        return order.to_dict(), 200, {"ETag": etag(order)}
 
 
     # Delete order
@@ -381,36 +795,73 @@ class OrderByIdResource(Resource):
         order = OrderModel.query.get(order_id)
         if not order:
             return {"error": "Order not found"}, 404
+        precondition = check_if_match(order)
+        if precondition:
+            return precondition
+        # the order's items go with it, and so do the units they hold
+        for order_item in OrderItemModel.query.filter_by(order_id=order.id).all():
+            inventory.release(order_item.product_id, order_item.quantity)
+            db.session.delete(order_item)
+        inventory.release(order.product_id, order.quantity)
         db.session.delete(order)
-        db.session.commit()
+        conflict = commit_versioned()
+        if conflict:
+            return conflict
         return {"message": "Order deleted successfully"}, 200
 
-api.add_resource(OrderByIdResource, '/orders/<int:order_id>')
+api.add_resource(ShardedOrderByIdResource if store.enabled else OrderByIdResource, '/orders/<int:order_id>')
 
 #order item resource class
+def adjust_order_totals(order_id, quantity, unit_price):
+    # one UPDATE adding to the stored totals, so item writes racing on one
+    # order all land instead of failing each other's version check; the
+    # version still moves, which ETags and archive.py's copy guard rely on
+    orders = OrderModel.__table__
+    version = db.session.execute(
+        update(orders)
+        .where(orders.c.id == order_id)
+        .values(
+            item_count=orders.c.item_count + quantity,
+            total=orders.c.total + quantity * (unit_price or 0),
+            version_id=orders.c.version_id + 1,
+        )
+        .returning(orders.c.version_id)
+    ).scalar()
+    if version is not None:
+        log_change(orders.name, order_id, 'update', version)
+
 class OrderItemResource(Resource):
     # Get all order items
     def get(self):
-        order_items = OrderItemModel.query.all()
+        order_items = archive.list_order_items()
         return [order_item.to_dict() for order_item in order_items], 200
 
     # Create an order item
     def post(self):
-        data = request.get_json()
-        if not data or not all(key in data for key in ("order_id", "product_id", "quantity")):
-            return {"error": "Missing required fields"}, 400
-
-        quantity = data["quantity"]
-        if quantity <= 0:
-            return {"error": "Quantity must be greater than zero"}, 400
+        body = decode(OrderItemBody)
+        quantity = body.quantity
+        product = live(ProductModel, body.product_id)
+        if not product:
+            return {"error": "Product not found"}, 404
+        order = db.session.get(OrderModel, body.order_id)
+        if not order:
+            return {"error": "Order not found"}, 404
+        try:
+            inventory.reserve(product.id, quantity)
+        except OutOfStock:
+            db.session.rollback()
+            return {"error": "Insufficient stock"}, 409
 
-        new_order_item = OrderItemModel(order_id=data["order_id"], product_id=data["product_id"], quantity=quantity)
+        new_order_item = OrderItemModel(order_id=order.id, product_id=product.id, quantity=quantity, unit_price=product.price)
         db.session.add(new_order_item)
-        db.session.commit()
+        adjust_order_totals(order.id, quantity, product.price)
+        conflict = commit_versioned()
+        if conflict:
+            return conflict
 
         return new_order_item.to_dict(), 201
 
-api.add_resource(OrderItemResource,'/order_items')
+api.add_resource(ShardedOrderItemResource if store.enabled else OrderItemResource,'/order_items')
 
 
 # Separate resource for handling individual order items by ID
@@ -419,25 +870,29 @@ class OrderItemByIdResource(Resource):
     def get(self, order_item_id):
         order_item = OrderItemModel.query.get(order_item_id)
         if not order_item:
+            archived = archive.get_order_item(order_item_id)
+            if archived:
+                return archived.to_dict(), 200
             return {"error": "Order item not found"}, 404
         return order_item.to_dict(), 200
 
     # Update order item
     def put(self, order_item_id):
-        data = request.get_json()
-        if not data or "quantity" not in data:
-            return {"error": "Missing required fields"}, 400
-
+        quantity = decode(QuantityBody).quantity
         order_item = OrderItemModel.query.get(order_item_id)
         if not order_item:
             return {"error": "Order item not found"}, 404
+        try:
+            inventory.adjust(order_item.product_id, quantity - order_item.quantity)
+        except OutOfStock:
+            db.session.rollback()
+            return {"error": "Insufficient stock"}, 409
 
-        quantity = data["quantity"]
-        if quantity <= 0:
-            return {"error": "Quantity must be greater than zero"}, 400
-
+        adjust_order_totals(order_item.order_id, quantity - order_item.quantity, order_item.unit_price)
         order_item.quantity = quantity
-        db.session.commit()
+        conflict = commit_versioned()
+        if conflict:
+            return conflict
         return order_item.to_dict(), 200
 
     # Delete order item
@@ -445,37 +900,37 @@ class OrderItemByIdResource(Resource):
         order_item = OrderItemModel.query.get(order_item_id)
         if not order_item:
             return {"error": "Order item not found"}, 404
+        inventory.release(order_item.product_id, order_item.quantity)
+        adjust_order_totals(order_item.order_id, -order_item.quantity, order_item.unit_price)
         db.session.delete(order_item)
-        db.session.commit()
+        conflict = commit_versioned()
+        if conflict:
+            return conflict
         return {"message": "Order item deleted successfully"}, 200
     
-api.add_resource(OrderItemByIdResource, '/order_items/<int:order_item_id>')
+api.add_resource(ShardedOrderItemByIdResource if store.enabled else OrderItemByIdResource, '/order_items/<int:order_item_id>')
 
 #review resource class
 class ReviewResource(Resource):
     # Get all reviews
     def get(self):
-        reviews = ReviewModel.query.all()
+        reviews = readmodels.list_reviews()
         return [review.to_dict() for review in reviews], 200
 
     # Create a review
     def post(self):
-        data = request.get_json()
-        if not data or not all(key in data for key in ("user_id", "product_id", "rating", "comment")):
-            return {"error": "Missing required fields"}, 400
-
-        rating = data["rating"]
-        if not (1 <= rating <= 5):
-            return {"error": "Rating must be between 1 and 5"}, 400
-
-        new_review = ReviewModel(user_id=data["user_id"], product_id=data["product_id"], rating=rating, comment=data["comment"])
+        body = decode(ReviewBody)
+        missing = check_live(body.user_id, body.product_id)
+        if missing:
+            return missing
+        new_review = ReviewModel(user_id=body.user_id, product_id=body.product_id, rating=body.rating, comment=body.comment)
         db.session.add(new_review)
         db.session.commit()
 
-        return new_review.to_dict(), 201
+        return new_review.to_dict(), 201, {"ETag": etag(new_review)}
     
 
-api.add_resource(ReviewResource,'/reviews')
+api.add_resource(ShardedReviewResource if store.enabled else ReviewResource,'/reviews')
 
 
 # Separate resource for handling individual reviews by ID
@@ -485,36 +940,193 @@ class ReviewByIdResource(Resource):
         review = ReviewModel.query.get(review_id)
         if not review:
             return {"error": "Review not found"}, 404
-        return review.to_dict(), 200
+        return review.to_dict(), 200, {"ETag": etag(review)}
 
     # Update review
     def put(self, review_id):
-        data = request.get_json()
-        if not data or not all(key in data for key in ("rating", "comment")):
-            return {"error": "Missing required fields"}, 400
-
+        body = decode(ReviewUpdateBody)
         review = ReviewModel.query.get(review_id)
         if not review:
             return {"error": "Review not found"}, 404
-
-        rating = data["rating"]
-        if not (1 <= rating <= 5):
-            return {"error": "Rating must be between 1 and 5"}, 400
-
-        review.rating = rating
-        review.comment = data["comment"]
-        db.session.commit()
-        return review.to_dict(), 200
+        precondition = check_if_match(review)
+        if precondition:
+            return precondition
+
+        review.rating = body.rating
+        review.comment = body.comment
+        conflict = commit_versioned()
+        if conflict:
+            return conflict
+        return review.to_dict(), 200, {"ETag": etag(review)}
     # Delete review
     def delete(self, review_id):
         review = ReviewModel.query.get(review_id)
         if not review:
             return {"error": "Review not found"}, 404
+        precondition = check_if_match(review)
+        if precondition:
+            return precondition
         db.session.delete(review)
-        db.session.commit()
+        conflict = commit_versioned()
+        if conflict:
+            return conflict
         return {"message": "Review deleted successfully"}, 200
     
-api.add_resource(ReviewByIdResource, '/reviews/<int:review_id>')
+api.add_resource(ShardedReviewByIdResource if store.enabled else ReviewByIdResource, '/reviews/<int:review_id>')
+
+#admin view of the background job queue
+class JobResource(Resource):
+    method_decorators = [admin_required]
+
+    # Get recent jobs, optionally filtered by status
+    def get(self):
+        query = JobModel.query
+        status = request.args.get("status")
+        if status:
+            query = query.filter(JobModel.status == status)
+        limit = request.args.get("limit", 100, type=int)
+        jobs = query.order_by(JobModel.id.desc()).limit(limit).all()
+        return [job.to_dict() for job in jobs], 200
+
+api.add_resource(JobResource, '/admin/jobs')
+
+class JobByIdResource(Resource):
+    method_decorators = [admin_required]
+
+    # Get job by ID
+    def get(self, job_id):
+        job = JobModel.query.get(job_id)
+        if not job:
+            return {"error": "Job not found"}, 404
+        return job.to_dict(), 200
+
+api.add_resource(JobByIdResource, '/admin/jobs/<int:job_id>')
+
+#admin view of the database maintenance tasks
+class MaintenanceResource(Resource):
+    method_decorators = [admin_required]
+
+    # Get each task's interval, run counts and last result
+    def get(self):
+        if not maintenance.enabled:
+            return {"error": "Database maintenance only runs on SQLite"}, 404
+        return maintenance.status(), 200
+
+api.add_resource(MaintenanceResource, '/admin/maintenance')
+
+#admin view of user and product purges, see purge.py
+class PurgeResource(Resource):
+    method_decorators = [admin_required]
+
+    # Get recent purges, optionally filtered by status
+    def get(self):
+        query = PurgeModel.query
+        status = request.args.get("status")
+        if status:
+            query = query.filter(PurgeModel.status == status)
+        limit = request.args.get("limit", 100, type=int)
+        purges = query.order_by(PurgeModel.id.desc()).limit(limit).all()
+        return [purge.to_dict() for purge in purges], 200
+
+api.add_resource(PurgeResource, '/admin/purges')
+
+class PurgeByIdResource(Resource):
+    method_decorators = [admin_required]
+
+    # Get purge progress by ID
+    def get(self, purge_id):
+        purge = PurgeModel.query.get(purge_id)
+        if not purge:
+            return {"error": "Purge not found"}, 404
+        return purge.to_dict(), 200
+
+api.add_resource(PurgeByIdResource, '/admin/purges/<int:purge_id>')
+
+#change feed for downstream consumers
+class ChangeFeedResource(Resource):
+    MAX_LIMIT = 1000
+    MAX_WAIT = 30
+    HEARTBEAT = 15
+    # every request that waits or streams holds one slot, see CHANGE_FEED_WAITERS
+    waiters = threading.BoundedSemaphore(app.config['CHANGE_FEED_WAITERS'])
+
+    # Get changes after `since`, long-polling up to `wait` seconds or streaming as SSE
+    def get(self):
+        since = request.args.get("since", 0, type=int)
+        limit = min(request.args.get("limit", 100, type=int), self.MAX_LIMIT)
+
+        if request.args.get("stream") or "text/event-stream" in request.headers.get("Accept", ""):
+            if not self.waiters.acquire(blocking=False):
+                return self.busy()
+            since = request.headers.get("Last-Event-ID", since, type=int)
+            response = Response(
+                stream_with_context(self.stream(since, limit)),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+            response.call_on_close(self.waiters.release)
+            return response
+
+        wait = min(request.args.get("wait", 0, type=float), self.MAX_WAIT)
+        changes = changes_since(since, limit)
+        if not changes and wait > 0:
+            if not self.waiters.acquire(blocking=False):
+                return self.busy()
+            try:
+                changes = self.poll(since, limit, wait)
+            finally:
+                self.waiters.release()
+
+        last_seq = changes[-1].seq if changes else max(since, latest_seq())
+        return {"changes": [change.to_dict() for change in changes], "last_seq": last_seq}, 200
+
+    def poll(self, since, limit, wait):
+        deadline = time.monotonic() + wait
+        changes = []
+        while not changes and time.monotonic() < deadline:
+            # end the read transaction so the next query sees new commits
+            db.session.rollback()
+            wait_for_changes(min(deadline - time.monotonic(), 1.0))
+            changes = changes_since(since, limit)
+        return changes
+
+    def busy(self):
+        return {"error": "Too many change feed consumers waiting"}, 503, {"Retry-After": "1"}
+
+    def stream(self, since, limit):
+        last_sent = time.monotonic()
+        while True:
+            changes = changes_since(since, limit)
+            db.session.rollback()
+            for change in changes:
+                since = change.seq
+                yield "id: %d\nevent: change\ndata: %s\n\n" % (change.seq, json.dumps(change.to_dict()))
+            if changes:
+                last_sent = time.monotonic()
+                continue
+            if time.monotonic() - last_sent >= self.HEARTBEAT:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            wait_for_changes(1.0)
+
+api.add_resource(ChangeFeedResource, '/changes')
+
+#several API calls in one round trip, see batch.py
+class BatchResource(Resource):
+    def post(self):
+        body = decode(BatchBody)
+        items = body.requests
+        if not body.atomic:
+            return {"responses": batch.run(app, db, items)}, 200
+        if store.enabled:
+            # shard writes bypass the session and cannot join its transaction
+            return {"error": "Atomic batches are not available with sharding"}, 400
+        responses, failed = batch.run_atomic(app, db, items)
+        if failed is not None:
+            return {"error": "Batch rolled back", "failed": failed, "responses": responses}, responses[failed]["status"]
+        return {"responses": responses}, 200
+
+api.add_resource(BatchResource, '/batch')
 
 
 
@@ -527,4 +1139,14 @@ api.add_resource(ReviewByIdResource, '/reviews/<int:review_id>')
 
 
 if __name__ == '__main__':
-    serve(app, host="0.0.0.0", port=50200, threads=4)
\ No newline at end of file
+    from waitress import serve
+
+    # JOB_WORKERS=0 when the queue is drained by a separate `python jobs.py`
+    workers = WorkerPool(app, threads=int(os.environ.get('JOB_WORKERS', 2)))
+    workers.start()
+    # MAINTENANCE=0 when another process already runs the maintenance tasks
+    if os.environ.get('MAINTENANCE', '1') != '0':
+        maintenance.start()
+    serve(app, host="0.0.0.0", port=50200, threads=API_THREADS + app.config['CHANGE_FEED_WAITERS'])
+    maintenance.stop()
+    workers.stop()
\ No newline at end of file
@@ -0,0 +1,217 @@
+# archive.py
+# Hot/cold storage for orders.
+#
+# archive_orders() moves orders older than a cutoff, together with their
+# order items, out of the hot tables into a separate archive database (the
+# `archive` bind, ARCHIVE_DATABASE_URL). It works in small id-ordered chunks:
+# each chunk is first written to the archive, then removed from the hot
+# tables in one short transaction that also records the chunk's id range in
+# `archive_range`. The hot delete only takes orders whose version and items
+# are still what was copied; the rest stay hot for a later chunk. Readers
+# try the hot tables first and only fall back to the archive when that range
+# index says the id was archived.
+#
+#   python archive.py [days]     # archive orders older than `days` (default 180)
+#   python archive.py schema     # bring an existing archive up to the current columns
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, delete, func, insert, inspect, select, text, tuple_, update
+from sqlalchemy.schema import CreateColumn
+
+import readmodels
+from jobs import enqueue, job
+from models import db, OrderModel, OrderItemModel, ProductModel, ArchiveRangeModel
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BIND = 'archive'
+CHUNK_SIZE = 500
+# pause between chunks so foreground writers can take the write lock
+CHUNK_PAUSE = 0.05
+# a run re-enqueues itself after this long, well inside the job lease
+RUN_SECONDS = 60
+
+ORDERS = OrderModel.__table__
+ORDER_ITEMS = OrderItemModel.__table__
+
+
+def archive_engine():
+    return db.engines[ARCHIVE_BIND]
+
+
+def ensure_schema():
+    engine = archive_engine()
+    db.metadata.create_all(engine, tables=[ORDERS, ORDER_ITEMS])
+    # create_all leaves existing tables alone, so add columns the hot tables
+    # have gained since the archive was created
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as connection:
+        for table in (ORDERS, ORDER_ITEMS):
+            present = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in present:
+                    connection.execute(text('ALTER TABLE %s ADD COLUMN %s' % (
+                        engine.dialect.identifier_preparer.format_table(table),
+                        CreateColumn(column).compile(dialect=engine.dialect),
+                    )))
+                    added.append(column.name)
+        if 'unit_price' in added:
+            # same best effort as the hot backfill: today's catalog price
+            prices = db.session.execute(select(ProductModel.id, ProductModel.price)).all()
+            db.session.rollback()
+            if prices:
+                connection.execute(
+                    update(ORDER_ITEMS).where(ORDER_ITEMS.c.product_id == bindparam('product'))
+                    .values(unit_price=bindparam('price')),
+                    [{'product': product_id, 'price': price} for product_id, price in prices],
+                )
+        if 'total' in added:
+            # archived orders are immutable, so their totals only need filling once
+            items = ORDER_ITEMS.c
+            connection.execute(update(ORDERS).values(
+                item_count=select(func.coalesce(func.sum(items.quantity), 0))
+                .where(items.order_id == ORDERS.c.id).scalar_subquery(),
+                total=select(func.coalesce(func.sum(items.quantity * items.unit_price), 0))
+                .where(items.order_id == ORDERS.c.id).scalar_subquery(),
+            ))
+
+
+def has_archive():
+    return db.session.query(ArchiveRangeModel.id).first() is not None
+
+
+def in_archived_range(low_column, high_column, row_id):
+    return db.session.query(ArchiveRangeModel.id).filter(
+        low_column <= row_id, high_column >= row_id
+    ).first() is not None
+
+
+def get_order(order_id):
+    if not in_archived_range(ArchiveRangeModel.min_order_id, ArchiveRangeModel.max_order_id, order_id):
+        return None
+    with archive_engine().connect() as connection:
+        row = connection.execute(readmodels.ORDERS.where(OrderModel.id == order_id)).first()
+    return readmodels.OrderRow._make(row) if row else None
+
+
+def get_order_item(order_item_id):
+    if not in_archived_range(ArchiveRangeModel.min_order_item_id, ArchiveRangeModel.max_order_item_id, order_item_id):
+        return None
+    with archive_engine().connect() as connection:
+        row = connection.execute(readmodels.ORDER_ITEMS.where(OrderItemModel.id == order_item_id)).first()
+    return readmodels.OrderItemRow._make(row) if row else None
+
+
+def _merged(row_type, statement, hot_rows):
+    # both sides come back in id order, so a merge keeps the listing ordered
+    if not has_archive():
+        return hot_rows
+    with archive_engine().connect() as connection:
+        cold_rows = [row_type._make(row) for row in connection.execute(statement)]
+    return list(heapq.merge(cold_rows, hot_rows, key=lambda row: row.id))
+
+
+def list_orders():
+    return _merged(readmodels.OrderRow, readmodels.ORDERS, readmodels.list_orders())
+
+
+def list_order_items():
+    return _merged(readmodels.OrderItemRow, readmodels.ORDER_ITEMS, readmodels.list_order_items())
+
+
+def archive_chunk(cutoff, chunk_size=CHUNK_SIZE):
+    """Archive up to chunk_size of the oldest orders created before cutoff. Returns the count."""
+    orders = [
+        dict(row) for row in db.session.execute(
+            select(ORDERS).where(ORDERS.c.created_at < cutoff).order_by(ORDERS.c.id).limit(chunk_size)
+        ).mappings()
+    ]
+    if not orders:
+        db.session.rollback()
+        return 0
+    order_ids = [order['id'] for order in orders]
+    items = [
+        dict(row) for row in db.session.execute(
+            select(ORDER_ITEMS).where(ORDER_ITEMS.c.order_id.in_(order_ids)).order_by(ORDER_ITEMS.c.id)
+        ).mappings()
+    ]
+    db.session.rollback()
+
+    # copy first; deleting before the insert makes a retried chunk idempotent
+    with archive_engine().begin() as connection:
+        connection.execute(delete(ORDER_ITEMS).where(ORDER_ITEMS.c.order_id.in_(order_ids)))
+        connection.execute(delete(ORDERS).where(ORDERS.c.id.in_(order_ids)))
+        connection.execute(insert(ORDERS), orders)
+        if items:
+            connection.execute(insert(ORDER_ITEMS), items)
+
+    # the copy was read in a transaction that has ended: only remove hot rows
+    # that are still exactly what was copied. An order whose version moved
+    # (PUT, new items, totals) or that gained an item since stays hot.
+    item_ids = [item['id'] for item in items]
+    uncopied_item = select(ORDER_ITEMS.c.id).where(
+        ORDER_ITEMS.c.order_id == ORDERS.c.id, ORDER_ITEMS.c.id.notin_(item_ids)
+    ).exists()
+    db.session.execute(delete(ORDERS).where(
+        tuple_(ORDERS.c.id, ORDERS.c.version_id).in_([(order['id'], order['version_id']) for order in orders]),
+        ~uncopied_item,
+    ))
+    kept = set(db.session.execute(select(ORDERS.c.id).where(ORDERS.c.id.in_(order_ids))).scalars())
+    moved_ids = [order_id for order_id in order_ids if order_id not in kept]
+    moved_item_ids = [item['id'] for item in items if item['order_id'] not in kept]
+    if moved_item_ids:
+        db.session.execute(delete(ORDER_ITEMS).where(ORDER_ITEMS.c.id.in_(moved_item_ids)))
+    if moved_ids:
+        db.session.add(ArchiveRangeModel(
+            min_order_id=moved_ids[0],
+            max_order_id=moved_ids[-1],
+            min_order_item_id=min(moved_item_ids) if moved_item_ids else None,
+            max_order_item_id=max(moved_item_ids) if moved_item_ids else None,
+            order_count=len(moved_ids),
+        ))
+    db.session.commit()
+
+    if kept:
+        # drop the stale copies; a later chunk copies these orders afresh
+        with archive_engine().begin() as connection:
+            connection.execute(delete(ORDER_ITEMS).where(ORDER_ITEMS.c.order_id.in_(kept)))
+            connection.execute(delete(ORDERS).where(ORDERS.c.id.in_(kept)))
+    return len(moved_ids)
+
+
+@job('archive_orders', max_attempts=3)
+def archive_orders(older_than_days=180, chunk_size=CHUNK_SIZE, run_seconds=RUN_SECONDS):
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    ensure_schema()
+    deadline = time.monotonic() + run_seconds
+    total = 0
+    while True:
+        moved = archive_chunk(cutoff, chunk_size)
+        if not moved:
+            break
+        total += moved
+        if time.monotonic() > deadline:
+            # give the worker back before the job lease runs out
+            enqueue('archive_orders', older_than_days=older_than_days, chunk_size=chunk_size)
+            db.session.commit()
+            break
+        time.sleep(CHUNK_PAUSE)
+    logger.info("Archived %d orders created before %s", total, cutoff.isoformat())
+    return total
+
+
+if __name__ == '__main__':
+    import sys
+
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        if sys.argv[1:] == ['schema']:
+            ensure_schema()
+        else:
+            archive_orders(int(sys.argv[1]) if len(sys.argv) > 1 else 180)
@@ -0,0 +1,158 @@
+# auth.py
+# Stateless bearer tokens.
+#
+# POST /login checks the password with bcrypt once and hands out a short-lived
+# access token plus a longer-lived refresh token. Each token is
+# base64(claims) + "." + base64(HMAC-SHA256(claims, SECRET_KEY)), so checking
+# one on a protected request costs an HMAC and a dict lookup instead of a
+# bcrypt round or a database query.
+#
+# Revocation (logout, refresh-token rotation, password changes) is kept in
+# memory per process. With several processes, set SECRET_KEY for all of them
+# and keep ACCESS_TOKEN_SECONDS short: a token revoked in one process stays
+# valid in the others until it expires.
+#
+# The /admin endpoints and the user list also need the token's user to be
+# listed in ADMIN_USER_IDS; that is checked per request, not baked into the
+# token, so removing an id takes effect at once.
+import base64
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+ACCESS = 'access'
+REFRESH = 'refresh'
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=')
+
+
+def _decode(text):
+    return base64.urlsafe_b64decode(text + b'=' * (-len(text) % 4))
+
+
+class TokenAuth:
+    def __init__(self):
+        self.key = None
+        self.lifetimes = {}
+        self.admins = frozenset()
+        self._revoked = {}
+        self._revoked_users = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        secret = app.config.get('SECRET_KEY')
+        if not secret:
+            logger.warning("SECRET_KEY is not set; tokens will not survive a restart")
+            secret = app.config['SECRET_KEY'] = os.urandom(32).hex()
+        self.key = secret.encode() if isinstance(secret, str) else secret
+        self.lifetimes = {
+            ACCESS: app.config.get('ACCESS_TOKEN_SECONDS', 15 * 60),
+            REFRESH: app.config.get('REFRESH_TOKEN_SECONDS', 14 * 24 * 3600),
+        }
+        self.admins = frozenset(app.config.get('ADMIN_USER_IDS', ()))
+
+    def _sign(self, payload):
+        return _encode(hmac.new(self.key, payload, hashlib.sha256).digest())
+
+    def issue(self, user_id, kind=ACCESS):
+        now = time.time()
+        claims = {
+            'sub': user_id,
+            'typ': kind,
+            'iat': now,
+            'exp': int(now) + self.lifetimes[kind],
+            'jti': os.urandom(9).hex(),
+        }
+        payload = _encode(json.dumps(claims, separators=(',', ':')).encode())
+        return (payload + b'.' + self._sign(payload)).decode()
+
+    def issue_pair(self, user_id):
+        return {
+            'access_token': self.issue(user_id, ACCESS),
+            'refresh_token': self.issue(user_id, REFRESH),
+            'token_type': 'Bearer',
+            'expires_in': self.lifetimes[ACCESS],
+        }
+
+    def verify(self, token, kind=ACCESS):
+        """Return the token's claims, or raise InvalidToken."""
+        try:
+            payload, signature = token.encode().split(b'.')
+        except (UnicodeEncodeError, ValueError):
+            raise InvalidToken('Malformed token')
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            raise InvalidToken('Bad signature')
+        claims = json.loads(_decode(payload))
+        if claims['typ'] != kind:
+            raise InvalidToken('Wrong token type')
+        if claims['exp'] <= time.time():
+            raise InvalidToken('Token expired')
+        if claims['jti'] in self._revoked:
+            raise InvalidToken('Token revoked')
+        if claims['iat'] < self._revoked_users.get(claims['sub'], 0):
+            raise InvalidToken('Token revoked')
+        return claims
+
+    def revoke(self, claims):
+        now = time.time()
+        with self._lock:
+            self._revoked[claims['jti']] = claims['exp']
+            # expired tokens fail the exp check anyway, so forget them
+            if len(self._revoked) > 10000:
+                self._revoked = {jti: exp for jti, exp in self._revoked.items() if exp > now}
+
+    def revoke_user(self, user_id):
+        # every token issued to the user up to now
+        self._revoked_users[user_id] = time.time()
+
+
+tokens = TokenAuth()
+
+
+def bearer_token():
+    header = request.headers.get('Authorization', '')
+    scheme, _, token = header.partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' else None
+
+
+def token_required(view):
+    """Reject the request with a 401 unless it carries a valid access token.
+
+    Use it as a Resource's method_decorators; the claims end up in g.token.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = bearer_token()
+        if not token:
+            return {"error": "Authentication required"}, 401, {"WWW-Authenticate": "Bearer"}
+        try:
+            g.token = tokens.verify(token)
+        except InvalidToken as error:
+            return {"error": str(error)}, 401, {"WWW-Authenticate": 'Bearer error="invalid_token"'}
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def admin_required(view):
+    """token_required, then a 403 unless the token's user is an admin."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if g.token['sub'] not in tokens.admins:
+            return {"error": "Admin access required"}, 403
+        return view(*args, **kwargs)
+    return token_required(wrapper)
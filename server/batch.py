@@ -0,0 +1,135 @@
+# batch.py
+# POST /batch: several API calls in one round trip.
+#
+#   {"atomic": true, "requests": [
+#       {"method": "POST", "path": "/orders", "body": {"user_id": 1, "product_id": 2, "quantity": 1}},
+#       {"method": "POST", "path": "/order_items", "body": {"order_id": "$0.id", "product_id": 2, "quantity": 1}}
+#   ]}
+#
+# The body is decoded as schemas.BatchBody. Each sub-request goes through
+# the normal Flask dispatch (routing, resource, after_request hooks) inside a
+# test request context, without another HTTP round trip.
+# "$<index>.<field>" refers to a field of an earlier response:
+# as a whole JSON string it is replaced by the value itself, inside a path or
+# a longer string by its text.
+#
+# With "atomic": true the batch runs on one connection inside one
+# transaction, and the resources' own commits become savepoint releases. The
+# first sub-request that fails rolls the whole batch back.
+import re
+
+from flask import request
+
+# passed on from the batch request unless a sub-request sets its own
+FORWARDED_HEADERS = ('Authorization', 'X-Client-Id')
+KEPT_HEADERS = ('ETag', 'Location')
+
+REFERENCE = re.compile(r'\$(\d+)\.([A-Za-z_][\w.]*)')
+
+
+class BatchError(Exception):
+    pass
+
+
+def lookup(responses, index, path):
+    index = int(index)
+    if index >= len(responses):
+        raise BatchError('$%d refers to a later request' % index)
+    value = responses[index]['body']
+    if responses[index]['status'] >= 400:
+        raise BatchError('$%d failed' % index)
+    for field in path.split('.'):
+        try:
+            value = value[int(field)] if isinstance(value, list) else value[field]
+        except (KeyError, IndexError, TypeError, ValueError):
+            raise BatchError('$%d.%s not found' % (index, path))
+    return value
+
+
+def resolve(value, responses):
+    if isinstance(value, dict):
+        return {key: resolve(item, responses) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve(item, responses) for item in value]
+    if isinstance(value, str) and '$' in value:
+        whole = REFERENCE.fullmatch(value)
+        if whole:
+            return lookup(responses, *whole.groups())
+        return REFERENCE.sub(lambda match: str(lookup(responses, *match.groups())), value)
+    return value
+
+
+def dispatch(app, item, responses):
+    """Run one sub-request and return {"status", "body", "headers"}."""
+    try:
+        method = item.method.upper()
+        path = resolve(item.path, responses)
+        body = resolve(item.body, responses)
+    except BatchError as error:
+        return {'status': 400, 'body': {'error': str(error)}, 'headers': {}}
+    if path.split('?')[0].rstrip('/') == request.path.rstrip('/'):
+        return {'status': 400, 'body': {'error': 'Batches cannot be nested'}, 'headers': {}}
+
+    headers = {name: request.headers[name] for name in FORWARDED_HEADERS if name in request.headers}
+    headers.update(item.headers)
+    with app.test_request_context(
+        path, method=method, json=body, headers=headers,
+        environ_base={'REMOTE_ADDR': request.remote_addr},
+    ):
+        try:
+            response = app.full_dispatch_request()
+        except Exception:
+            app.logger.exception('Batch sub-request %s %s failed', method, path)
+            return {'status': 500, 'body': {'error': 'Internal Server Error'}, 'headers': {}}
+        if response.mimetype == 'text/event-stream':
+            response.close()
+            return {'status': 400, 'body': {'error': 'Streaming responses cannot be batched'}, 'headers': {}}
+        body = response.get_json(silent=True)
+        return {
+            'status': response.status_code,
+            'body': body if body is not None else response.get_data(as_text=True),
+            'headers': {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers},
+        }
+
+
+def run(app, db, items):
+    responses = []
+    for item in items:
+        responses.append(dispatch(app, item, responses))
+        if responses[-1]['status'] >= 500:
+            db.session.rollback()
+    return responses
+
+
+def run_atomic(app, db, items):
+    """Run every sub-request in one transaction. Returns (responses, failed index or None)."""
+    db.session.remove()
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    if connection.dialect.name == 'sqlite':
+        # pysqlite defers BEGIN, and a SAVEPOINT outside a transaction
+        # would commit on release
+        connection.exec_driver_sql('BEGIN')
+    db.session.registry.set(
+        db.session.session_factory(bind=connection, join_transaction_mode='create_savepoint')
+    )
+    responses = []
+    failed = None
+    committed = False
+    try:
+        for index, item in enumerate(items):
+            responses.append(dispatch(app, item, responses))
+            if responses[-1]['status'] >= 400:
+                failed = index
+                break
+        if failed is None:
+            db.session.flush()
+            db.session.remove()
+            transaction.commit()
+            committed = True
+    finally:
+        db.session.remove()
+        if not committed:
+            transaction.rollback()
+        connection.close()
+    return responses, failed
@@ -0,0 +1,76 @@
+# benchmarks/bench_auth.py
+# Per-request authentication cost: checking a password with bcrypt (what
+# authenticating every request with credentials would cost) versus verifying
+# an access token issued by /login.
+#
+#   python benchmarks/bench_auth.py [token-iterations]
+import os
+import sys
+import time
+
+from common import make_app, report
+
+import auth
+from auth import TokenAuth, token_required
+from models import db, get_bcrypt, UserModel
+
+TOKEN_ITERATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+BCRYPT_ITERATIONS = 20
+
+
+def per_call_us(call, iterations):
+    call()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call()
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+def main():
+    app, path = make_app()
+    app.config['SECRET_KEY'] = 'bench'
+    tokens = TokenAuth()
+    tokens.init_app(app)
+    # token_required checks the module's instance
+    auth.tokens = tokens
+
+    with app.app_context():
+        db.create_all()
+        user = UserModel(username='bench', email='bench@example.com', password='correct horse')
+        db.session.add(user)
+        db.session.commit()
+        password_hash = user.password_hash
+        access = tokens.issue(user.id)
+        db.engine.dispose()
+    os.remove(path)
+    bcrypt = get_bcrypt()
+
+    protected = token_required(lambda: None)
+    headers = {'Authorization': 'Bearer ' + access}
+
+    def bare_request():
+        with app.test_request_context('/users/1', headers=headers):
+            pass
+
+    def guarded_request():
+        with app.test_request_context('/users/1', headers=headers):
+            protected()
+
+    results = [
+        ('bcrypt check_password_hash',
+         per_call_us(lambda: bcrypt.check_password_hash(password_hash, 'correct horse'), BCRYPT_ITERATIONS)),
+        ('issue access token', per_call_us(lambda: tokens.issue(1), TOKEN_ITERATIONS)),
+        ('verify access token', per_call_us(lambda: tokens.verify(access), TOKEN_ITERATIONS)),
+        ('request context alone', per_call_us(bare_request, TOKEN_ITERATIONS // 10)),
+        ('request context + token_required', per_call_us(guarded_request, TOKEN_ITERATIONS // 10)),
+    ]
+    baseline = results[0][1]
+    report(
+        'Authentication cost per request',
+        [(name, '%.1f' % us, '%.0fx' % (baseline / us)) for name, us in results],
+        ('check', 'us/call', 'cheaper than bcrypt'),
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# benchmarks/bench_inventory.py
+# Order throughput on a single hot product as its stock is split over more
+# slots. Each slot count gets a fresh SQLite file; WRITERS threads place
+# one-unit orders (inventory.reserve() plus the order row, one transaction per
+# order) for SECONDS seconds. 1 slot is the old single stock counter.
+#
+# SQLite lets one transaction write at a time whatever rows it touches, so
+# here the numbers mostly show what the slot picking costs; the row-level
+# contention that slots remove shows up on databases with row locks.
+#
+#   python benchmarks/bench_inventory.py [writers] [seconds]
+import os
+import sys
+import threading
+import time
+
+from common import make_app, report
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+
+import inventory
+from models import db, OrderModel, ProductModel, ProductStockSlotModel
+
+WRITERS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+SECONDS = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+SLOT_COUNTS = (1, 2, 4, 8, 16)
+STOCK = 10_000_000
+
+
+def run(slots):
+    inventory.SLOTS = slots
+    app, path = make_app()
+    with app.app_context():
+        db.create_all()
+        product = ProductModel(name='hot shoe', price=10.0, stock=STOCK)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+
+    counts = [0] * WRITERS
+    busy = [0] * WRITERS
+    deadline = time.monotonic() + SECONDS
+
+    def writer(index):
+        with app.app_context():
+            while time.monotonic() < deadline:
+                try:
+                    inventory.reserve(product_id, 1)
+                    db.session.add(OrderModel(user_id=1 + index, product_id=product_id, quantity=1))
+                    db.session.commit()
+                    counts[index] += 1
+                except OperationalError:
+                    db.session.rollback()
+                    busy[index] += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        left = db.session.query(func.sum(ProductStockSlotModel.quantity)).scalar()
+        orders = db.session.query(func.count(OrderModel.id)).scalar()
+        assert left + orders == STOCK, 'units went missing'
+        db.engine.dispose()
+    os.remove(path)
+    return sum(counts), sum(busy)
+
+
+def main():
+    default_slots = inventory.SLOTS
+    results = []
+    baseline = None
+    for slots in SLOT_COUNTS:
+        orders, busy = run(slots)
+        rate = orders / SECONDS
+        baseline = baseline or rate
+        results.append((slots, orders, busy, '%.0f' % rate, '%.2fx' % (rate / baseline)))
+    inventory.SLOTS = default_slots
+    report(
+        'Orders for one product, %d writer threads, %.0f s per run' % (WRITERS, SECONDS),
+        results,
+        ('slots', 'orders', 'busy retries', 'orders/s', 'vs 1 slot'),
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# benchmarks/bench_read_layer.py
+# Memory and throughput of the list endpoints' read path: full ORM instances
+# (Model.query.all() + to_dict) versus the slotted rows from readmodels.
+#
+#   python benchmarks/bench_read_layer.py [rows]
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+from common import make_app, report
+
+from sqlalchemy import insert
+
+import readmodels
+from models import db, ProductModel, OrderModel, OrderItemModel, ReviewModel
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+
+def seed(rows):
+    db.create_all()
+    db.session.execute(insert(ProductModel), [
+        {'id': i, 'name': 'product-%d' % i, 'price': 10.0 + i % 50, 'stock': 100} for i in range(1, rows + 1)
+    ])
+    db.session.execute(insert(OrderModel), [
+        {'id': i, 'user_id': i % 1000 + 1, 'product_id': i, 'quantity': 1} for i in range(1, rows + 1)
+    ])
+    db.session.execute(insert(OrderItemModel), [
+        {'id': i, 'order_id': i, 'product_id': i, 'quantity': 2} for i in range(1, rows + 1)
+    ])
+    db.session.execute(insert(ReviewModel), [
+        {'id': i, 'user_id': i % 1000 + 1, 'product_id': i, 'rating': i % 5 + 1, 'comment': 'Great product!'}
+        for i in range(1, rows + 1)
+    ])
+    db.session.commit()
+
+
+def run(load):
+    rows = load()
+    return [row.to_dict() for row in rows]
+
+
+def measure(load):
+    # timing and allocation tracking are separate passes because
+    # tracemalloc itself slows allocation-heavy code down considerably
+    db.session.remove()
+    gc.collect()
+    start = time.perf_counter()
+    run(load)
+    elapsed = time.perf_counter() - start
+
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    body = run(load)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del body
+    db.session.remove()
+    return elapsed, peak
+
+
+def main():
+    app, path = make_app()
+    cases = [
+        ('products', lambda: ProductModel.query.all(), readmodels.list_products),
+        ('orders', lambda: OrderModel.query.all(), readmodels.list_orders),
+        ('order_items', lambda: OrderItemModel.query.all(), readmodels.list_order_items),
+        ('reviews', lambda: ReviewModel.query.all(), readmodels.list_reviews),
+    ]
+    try:
+        with app.app_context():
+            seed(ROWS)
+            results = []
+            for name, orm_load, lean_load in cases:
+                # warm the statement caches so both sides are measured hot
+                run(orm_load)
+                run(lean_load)
+                orm_time, orm_peak = measure(orm_load)
+                lean_time, lean_peak = measure(lean_load)
+                results.append((
+                    name,
+                    '%.3f' % orm_time, '%.3f' % lean_time, '%.1fx' % (orm_time / lean_time),
+                    '%.1f' % (orm_peak / 2**20), '%.1f' % (lean_peak / 2**20), '%.1fx' % (orm_peak / lean_peak),
+                ))
+        report(
+            'List read path, %d rows per table' % ROWS,
+            results,
+            ('table', 'orm s', 'lean s', 'speedup', 'orm MiB', 'lean MiB', 'saving'),
+        )
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
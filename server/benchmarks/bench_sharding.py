@@ -0,0 +1,76 @@
+# benchmarks/bench_sharding.py
+# Order write throughput as the shard count grows. Each shard count gets fresh
+# SQLite files; WRITERS threads insert orders for random users, one
+# transaction per order, for SECONDS seconds.
+#
+#   python benchmarks/bench_sharding.py [max-shards] [writers] [seconds]
+import os
+import random
+import sys
+import threading
+import time
+
+from common import make_app, report, temp_db_path
+
+from models import db
+from sharding import ShardedStore
+
+MAX_SHARDS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+WRITERS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+SECONDS = float(sys.argv[3]) if len(sys.argv) > 3 else 5.0
+
+
+def run(shard_count):
+    paths = {'shard_%d' % n: temp_db_path() for n in range(shard_count)}
+    app, catalog = make_app(binds=paths)
+    app.config['SQLALCHEMY_SHARDS'] = list(paths)
+    store = ShardedStore()
+    store.init_app(app, db)
+    with app.app_context():
+        db.create_all()
+        store.create_all()
+
+    counts = [0] * WRITERS
+    deadline = time.monotonic() + SECONDS
+
+    def writer(index):
+        rng = random.Random(index)
+        with app.app_context():
+            while time.monotonic() < deadline:
+                store.insert('order', {'user_id': rng.randint(1, 100_000), 'product_id': 1, 'quantity': 1})
+                counts[index] += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        db.engine.dispose()
+        for key in paths:
+            db.engines[key].dispose()
+    for path in [catalog, *paths.values()]:
+        os.remove(path)
+    return sum(counts)
+
+
+def main():
+    results = []
+    baseline = None
+    shard_count = 1
+    while shard_count <= MAX_SHARDS:
+        written = run(shard_count)
+        rate = written / SECONDS
+        baseline = baseline or rate
+        results.append((shard_count, written, '%.0f' % rate, '%.2fx' % (rate / baseline)))
+        shard_count *= 2
+    report(
+        'Order inserts, %d writer threads, %.0f s per run' % (WRITERS, SECONDS),
+        results,
+        ('shards', 'orders', 'orders/s', 'vs 1 shard'),
+    )
+
+
+if __name__ == '__main__':
+    main()
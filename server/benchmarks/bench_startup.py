@@ -0,0 +1,102 @@
+# benchmarks/bench_startup.py
+# Worker startup cost: an `-X importtime` report for `import app` plus the
+# wall time until /readyz first answers 200.
+#
+# Both run in subprocesses pointed at throwaway SQLite files in a temporary
+# directory (see common.py: benchmarks never touch instance/data.db). The
+# schema is created between the import and the probe and is not timed.
+#
+#   python benchmarks/bench_startup.py [top-n]
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import report
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOP = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+READY_PROBE = """
+import time
+start = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+import archive
+from models import db
+with app.app_context():
+    db.create_all()
+    archive.ensure_schema()
+probe = time.perf_counter()
+response = app.test_client().get('/readyz')
+ready = imported - start + time.perf_counter() - probe
+assert response.status_code == 200, response.get_json()
+print('%f %f' % (imported - start, ready))
+"""
+
+
+def scratch_env(directory):
+    return dict(
+        os.environ,
+        DATABASE_URL='sqlite:///' + os.path.join(directory, 'data.db'),
+        ARCHIVE_DATABASE_URL='sqlite:///' + os.path.join(directory, 'archive.db'),
+        BACKUP_DIR=os.path.join(directory, 'backups'),
+    )
+
+
+def import_times(env):
+    # -X importtime writes "import time: self | cumulative | name" to stderr
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'],
+        cwd=SERVER_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    # children are printed before their parent, indented two spaces per level
+    children = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            children.append((name.strip(), int(self_us), int(cumulative_us)))
+        elif depth == 0:
+            if name.strip() == 'app':
+                return int(cumulative_us), children
+            children = []
+    raise RuntimeError('no importtime entry for app')
+
+
+def main():
+    with tempfile.TemporaryDirectory(prefix='bench-startup-') as directory:
+        run(scratch_env(directory))
+
+
+def run(env):
+    total, imports = import_times(env)
+    imports.sort(key=lambda row: row[2], reverse=True)
+    report(
+        'Slowest direct imports of app.py (`import app` total %.1f ms)' % (total / 1000),
+        [(name, '%.1f' % (self_us / 1000), '%.1f' % (cumulative_us / 1000))
+         for name, self_us, cumulative_us in imports[:TOP]],
+        ('module', 'self ms', 'cumulative ms'),
+    )
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', READY_PROBE],
+        cwd=SERVER_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    process = time.perf_counter() - start
+    imported, ready = (float(value) for value in result.stdout.split())
+    report(
+        'Time to ready',
+        [('import app', '%.1f' % (imported * 1000)),
+         ('first /readyz 200 (excl. schema)', '%.1f' % (ready * 1000)),
+         ('process incl. interpreter', '%.1f' % (process * 1000))],
+        ('stage', 'ms'),
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+# benchmarks/common.py
+# Shared setup for the benchmark scripts: a throwaway Flask app bound to a
+# temporary SQLite file, so benchmarks never touch instance/data.db.
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from models import db
+
+
+def temp_db_path():
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='bench-')
+    os.close(fd)
+    return path
+
+
+def make_app(path=None, binds=None):
+    if path is None:
+        path = temp_db_path()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.config['SQLALCHEMY_BINDS'] = {key: 'sqlite:///' + bind for key, bind in (binds or {}).items()}
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app, path
+
+
+def report(title, rows, headers):
+    print(title)
+    widths = [max(len(str(h)), *(len(str(r[i])) for r in rows)) for i, h in enumerate(headers)]
+    print("  ".join(str(h).ljust(w) for h, w in zip(headers, widths)))
+    for row in rows:
+        print("  ".join(str(c).ljust(w) for c, w in zip(row, widths)))
+    print()
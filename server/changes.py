@@ -0,0 +1,88 @@
+# changes.py
+# Change-data-capture for the API models.
+#
+# Every flush appends one compact row per inserted, updated or deleted object
+# to the `change` table, inside the same transaction as the write itself, so
+# the log only ever contains committed changes. Consumers read it through
+# /changes?since=<seq> instead of diffing full snapshots.
+import threading
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+from models import db, ChangeModel
+
+# tables whose writes are published; internal bookkeeping tables are not
+TRACKED_TABLES = {'user', 'product', 'cart', 'cart_item', 'order', 'order_item', 'review'}
+
+# woken after every commit that appended changes, so long-polls return promptly
+_new_changes = threading.Condition()
+
+
+def _change_row(obj, op):
+    table = getattr(obj, '__tablename__', None)
+    if table not in TRACKED_TABLES:
+        return None
+    return {
+        'table_name': table,
+        'row_id': obj.id,
+        'op': op,
+        'version': getattr(obj, 'version_id', None),
+    }
+
+
+@event.listens_for(Session, 'after_flush')
+def _capture_changes(session, flush_context):
+    rows = []
+    for obj in session.new:
+        rows.append(_change_row(obj, 'insert'))
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            rows.append(_change_row(obj, 'update'))
+    for obj in session.deleted:
+        rows.append(_change_row(obj, 'delete'))
+    rows = [row for row in rows if row is not None]
+    if rows:
+        session.connection().execute(ChangeModel.__table__.insert(), rows)
+        session.info['changes_pending'] = True
+
+
+def log_change(table_name, row_id, op, version=None):
+    """Log a write made with a plain UPDATE/DELETE, which flushes do not see."""
+    db.session.execute(ChangeModel.__table__.insert(), [
+        {'table_name': table_name, 'row_id': row_id, 'op': op, 'version': version},
+    ])
+    db.session.info['changes_pending'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_changes(session):
+    if session.info.pop('changes_pending', False):
+        with _new_changes:
+            _new_changes.notify_all()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('changes_pending', None)
+
+
+def changes_since(since, limit=100):
+    return (
+        ChangeModel.query
+        .filter(ChangeModel.seq > since)
+        .order_by(ChangeModel.seq)
+        .limit(limit)
+        .all()
+    )
+
+
+def wait_for_changes(timeout):
+    # writers in other processes never notify us, so callers keep the
+    # timeout short and re-query in a loop
+    with _new_changes:
+        _new_changes.wait(timeout)
+
+
+def latest_seq():
+    return db.session.query(db.func.max(ChangeModel.seq)).scalar() or 0
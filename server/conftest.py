@@ -0,0 +1,45 @@
+# conftest.py
+# pytest fixtures over testing.py. The template is built once per process
+# (once per xdist worker) and every test gets the seeded state back.
+import pytest
+
+import testing
+
+
+@pytest.fixture(scope='session')
+def app():
+    return testing.create_app()
+
+
+@pytest.fixture(scope='session')
+def templates(app):
+    from models import db
+
+    databases = testing.TemplateDatabases(app, db).build()
+    yield databases
+    databases.close()
+
+
+@pytest.fixture
+def database(app, templates):
+    from models import db
+
+    templates.restore()
+    with app.app_context():
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app, database):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(database):
+    return testing.auth_headers
+
+
+@pytest.fixture
+def run_jobs(database):
+    return testing.run_jobs
@@ -0,0 +1,196 @@
+# inventory.py
+# Product stock split into sub-counter slots.
+#
+# Each product's stock lives in SLOTS rows of `product_stock_slot` instead of
+# one counter, so concurrent orders for the same product mostly update
+# different rows. reserve() takes the units from one randomly chosen slot
+# with a conditional UPDATE (quantity >= wanted). Only when that slot is short
+# does it lock all of the product's slots and take the units from several.
+#
+# Random picks drift the slots apart. rebalance() evens out products whose
+# emptiest slot has fallen below half its share, and refreshes `product.stock`,
+# the cached total that reads use. ProductModel.available is the exact sum.
+#
+# New products get their slots from the after_insert hook below, and
+# set_stock() replaces them when a product's stock is set outright.
+#
+# Worker pools start the repeating rebalance job (see jobs.recurring), which
+# then runs every REBALANCE_INTERVAL seconds.
+#
+#   python inventory.py      # rebalance once
+import logging
+import random
+
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy.exc import OperationalError
+
+from jobs import enqueue, job, recurring
+from models import db, ProductModel, ProductStockSlotModel
+
+logger = logging.getLogger(__name__)
+
+SLOTS = 8
+# seconds between runs of a repeating rebalance job
+REBALANCE_INTERVAL = 60
+# products rebalanced per run
+REBALANCE_LIMIT = 1000
+
+SLOTS_TABLE = ProductStockSlotModel.__table__
+PRODUCTS = ProductModel.__table__
+
+
+class OutOfStock(Exception):
+    pass
+
+
+def spread(total, slots=None):
+    # SLOTS is read per call, so setting inventory.SLOTS takes effect
+    if slots is None:
+        slots = SLOTS
+    base, extra = divmod(total, slots)
+    return [base + (1 if slot < extra else 0) for slot in range(slots)]
+
+
+def slot_rows(product_id, stock, slots=None):
+    return [
+        {'product_id': product_id, 'slot': slot, 'quantity': quantity}
+        for slot, quantity in enumerate(spread(stock, slots))
+    ]
+
+
+@event.listens_for(ProductModel, 'after_insert')
+def _create_slots(mapper, connection, product):
+    connection.execute(insert(SLOTS_TABLE), slot_rows(product.id, product.stock))
+
+
+def set_stock(product, stock):
+    """Set a product's stock outright, replacing its slots."""
+    product.stock = stock
+    db.session.execute(delete(SLOTS_TABLE).where(SLOTS_TABLE.c.product_id == product.id))
+    db.session.execute(insert(SLOTS_TABLE), slot_rows(product.id, stock))
+
+
+def _take(product_id, slot, quantity):
+    return db.session.execute(
+        update(SLOTS_TABLE)
+        .where(
+            SLOTS_TABLE.c.product_id == product_id,
+            SLOTS_TABLE.c.slot == slot,
+            SLOTS_TABLE.c.quantity >= quantity,
+        )
+        .values(quantity=SLOTS_TABLE.c.quantity - quantity)
+    ).rowcount == 1
+
+
+def reserve(product_id, quantity):
+    """Take `quantity` units in the session's transaction, or raise OutOfStock.
+
+    After OutOfStock the caller must roll back: units already taken from
+    other slots are only returned by the rollback.
+    """
+    if _take(product_id, random.randrange(SLOTS), quantity):
+        return
+    # the picked slot is short: lock the product's slots and take from the fullest
+    slots = db.session.execute(
+        select(SLOTS_TABLE.c.slot, SLOTS_TABLE.c.quantity)
+        .where(SLOTS_TABLE.c.product_id == product_id, SLOTS_TABLE.c.quantity > 0)
+        .order_by(SLOTS_TABLE.c.quantity.desc())
+        .with_for_update()
+    ).all()
+    if sum(available for _, available in slots) < quantity:
+        raise OutOfStock(product_id)
+    remaining = quantity
+    for slot, available in slots:
+        take = min(available, remaining)
+        if not _take(product_id, slot, take):
+            raise OutOfStock(product_id)
+        remaining -= take
+        if not remaining:
+            break
+
+
+def release(product_id, quantity):
+    """Put `quantity` units back, in the session's transaction."""
+    db.session.execute(
+        update(SLOTS_TABLE)
+        .where(SLOTS_TABLE.c.product_id == product_id, SLOTS_TABLE.c.slot == random.randrange(SLOTS))
+        .values(quantity=SLOTS_TABLE.c.quantity + quantity)
+    )
+
+
+def adjust(product_id, delta):
+    """Take `delta` units, or put them back when it is negative."""
+    if delta > 0:
+        reserve(product_id, delta)
+    elif delta < 0:
+        release(product_id, -delta)
+
+
+def rebalance_product(product_id):
+    """Spread a product's units evenly over its slots and refresh the cached total."""
+    # writing first takes SQLite's write lock up front, so the reads below
+    # cannot go stale before the slots are rewritten
+    total = select(func.coalesce(func.sum(SLOTS_TABLE.c.quantity), 0)).where(
+        SLOTS_TABLE.c.product_id == product_id
+    ).scalar_subquery()
+    db.session.execute(update(PRODUCTS).where(PRODUCTS.c.id == product_id).values(stock=total))
+    slots = db.session.execute(
+        select(SLOTS_TABLE.c.slot, SLOTS_TABLE.c.quantity)
+        .where(SLOTS_TABLE.c.product_id == product_id)
+        .order_by(SLOTS_TABLE.c.slot)
+        .with_for_update()
+    ).all()
+    even = spread(sum(quantity for _, quantity in slots), len(slots))
+    moved = 0
+    for (slot, quantity), target in zip(slots, even):
+        if quantity != target:
+            db.session.execute(
+                update(SLOTS_TABLE)
+                .where(SLOTS_TABLE.c.product_id == product_id, SLOTS_TABLE.c.slot == slot)
+                .values(quantity=target)
+            )
+            moved += max(0, quantity - target)
+    return moved
+
+
+@job('rebalance_inventory', max_attempts=3)
+def rebalance(repeat=False, limit=REBALANCE_LIMIT):
+    # a slot below half its share: 2 * count * min < sum
+    skewed = db.session.execute(
+        select(SLOTS_TABLE.c.product_id)
+        .group_by(SLOTS_TABLE.c.product_id)
+        .having(func.min(SLOTS_TABLE.c.quantity) * 2 * func.count() < func.sum(SLOTS_TABLE.c.quantity))
+        .limit(limit)
+    ).scalars().all()
+    db.session.rollback()
+    moved = 0
+    for product_id in skewed:
+        try:
+            moved += rebalance_product(product_id)
+            db.session.commit()
+        except OperationalError:
+            # busy with orders right now; the next run gets it
+            db.session.rollback()
+
+    # the cached totals of products that were not skewed, in one statement
+    total = select(func.coalesce(func.sum(SLOTS_TABLE.c.quantity), 0)).where(
+        SLOTS_TABLE.c.product_id == PRODUCTS.c.id
+    ).scalar_subquery()
+    refreshed = db.session.execute(update(PRODUCTS).where(PRODUCTS.c.stock != total).values(stock=total)).rowcount
+    db.session.commit()
+    logger.info("Inventory: rebalanced %d products, moved %d units, refreshed %d totals", len(skewed), moved, refreshed)
+    if repeat:
+        enqueue('rebalance_inventory', delay=REBALANCE_INTERVAL, repeat=True)
+        db.session.commit()
+    return moved
+
+
+recurring('rebalance_inventory', repeat=True)
+
+
+if __name__ == '__main__':
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        rebalance()
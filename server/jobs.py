@@ -0,0 +1,238 @@
+# jobs.py
+# Durable background job queue backed by the `job` table.
+#
+# enqueue() adds the job row to the caller's session without committing, so
+# the job is committed (or rolled back) with the write that asked for it and
+# a crash in between can neither lose it nor run it for a write that never
+# happened. A pool of worker threads (started next to waitress in app.py, or
+# standalone with `python jobs.py`) claims due jobs, runs the registered
+# handler and retries failures with exponential backoff. Every
+# REQUEUE_INTERVAL the pool also hands back jobs whose worker died.
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, update
+from sqlalchemy.orm import Session
+
+from models import db, JobModel
+
+logger = logging.getLogger(__name__)
+
+# seconds between polls when the queue is empty
+POLL_INTERVAL = 1.0
+# a job locked for longer than this is assumed to belong to a dead worker
+LEASE_TIMEOUT = timedelta(minutes=5)
+# seconds between sweeps for jobs held by dead workers
+REQUEUE_INTERVAL = 60.0
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 600.0
+
+_handlers = {}
+_recurring = {}
+_wakeup = threading.Event()
+
+
+def job(name, max_attempts=5):
+    """Register a function as the handler for jobs called `name`."""
+    def decorator(func):
+        _handlers[name] = (func, max_attempts)
+        return func
+    return decorator
+
+
+def enqueue(name, delay=0, **payload):
+    """Add a job to the session; it is queued when the caller commits."""
+    if name not in _handlers:
+        raise KeyError("Unknown job: %s" % name)
+    _, max_attempts = _handlers[name]
+    new_job = JobModel(
+        name=name,
+        payload=json.dumps(payload),
+        max_attempts=max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    db.session.add(new_job)
+    db.session.info['jobs_pending'] = True
+    return new_job
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('jobs_pending', False):
+        _wakeup.set()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_jobs(session):
+    session.info.pop('jobs_pending', None)
+
+
+def recurring(name, **payload):
+    """Have every WorkerPool start make sure a `name` job is queued.
+
+    For jobs that re-enqueue themselves: this only starts the chain, and a
+    pool finding one queued or running leaves it alone.
+    """
+    _recurring[name] = payload
+
+
+def schedule_recurring():
+    for name, payload in _recurring.items():
+        pending = (
+            db.session.query(JobModel.id)
+            .filter(JobModel.name == name, JobModel.status.in_(('queued', 'running')))
+            .first()
+        )
+        if pending is None:
+            enqueue(name, **payload)
+    db.session.commit()
+
+
+def backoff(attempts):
+    # 2, 4, 8, ... seconds with jitter, capped at BACKOFF_MAX
+    delay = min(BACKOFF_BASE ** attempts, BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def requeue_stale():
+    # give jobs held by crashed workers back to the queue
+    cutoff = datetime.utcnow() - LEASE_TIMEOUT
+    result = db.session.execute(
+        update(JobModel)
+        .where(JobModel.status == 'running', JobModel.locked_at < cutoff)
+        .values(status='queued', locked_by=None, locked_at=None)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def claim_next(worker_id):
+    """Atomically take the oldest due job, or return None."""
+    now = datetime.utcnow()
+    candidate = (
+        db.session.query(JobModel.id)
+        .filter(JobModel.status == 'queued', JobModel.run_at <= now)
+        .order_by(JobModel.run_at, JobModel.id)
+        .first()
+    )
+    if candidate is None:
+        db.session.rollback()
+        return None
+
+    # the status guard makes the claim safe across threads and processes
+    result = db.session.execute(
+        update(JobModel)
+        .where(JobModel.id == candidate.id, JobModel.status == 'queued')
+        .values(status='running', locked_by=worker_id, locked_at=now,
+                attempts=JobModel.attempts + 1)
+    )
+    db.session.commit()
+    if result.rowcount != 1:
+        return None
+    return db.session.get(JobModel, candidate.id)
+
+
+def run_one(worker_id):
+    """Run a single due job. Returns False when the queue had nothing to do."""
+    claimed = claim_next(worker_id)
+    if claimed is None:
+        return False
+
+    handler = _handlers.get(claimed.name)
+    try:
+        if handler is None:
+            raise KeyError("No handler registered for %s" % claimed.name)
+        handler[0](**json.loads(claimed.payload))
+    except Exception as exc:
+        db.session.rollback()
+        logger.exception("Job %s (%s) failed", claimed.id, claimed.name)
+        claimed = db.session.get(JobModel, claimed.id)
+        claimed.last_error = "%s: %s" % (type(exc).__name__, exc)
+        claimed.locked_by = None
+        claimed.locked_at = None
+        if claimed.attempts >= claimed.max_attempts:
+            claimed.status = 'failed'
+            claimed.finished_at = datetime.utcnow()
+        else:
+            claimed.status = 'queued'
+            claimed.run_at = datetime.utcnow() + timedelta(seconds=backoff(claimed.attempts))
+    else:
+        claimed.status = 'done'
+        claimed.locked_by = None
+        claimed.locked_at = None
+        claimed.finished_at = datetime.utcnow()
+    db.session.commit()
+    return True
+
+
+class WorkerPool:
+    def __init__(self, app, threads=2):
+        self.app = app
+        self.threads = threads
+        self._stop = threading.Event()
+        self._workers = []
+
+    def start(self):
+        if self.threads:
+            with self.app.app_context():
+                schedule_recurring()
+                db.session.remove()
+        prefix = "%s:%s" % (socket.gethostname(), os.getpid())
+        for n in range(self.threads):
+            worker = threading.Thread(
+                target=self._run, args=("%s:%d" % (prefix, n),), name="job-worker-%d" % n, daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        _wakeup.set()
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def _run(self, worker_id):
+        with self.app.app_context():
+            next_sweep = 0
+            while not self._stop.is_set():
+                try:
+                    if time.monotonic() >= next_sweep:
+                        requeue_stale()
+                        next_sweep = time.monotonic() + REQUEUE_INTERVAL
+                    if run_one(worker_id):
+                        continue
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("Job worker %s crashed while polling", worker_id)
+                _wakeup.wait(POLL_INTERVAL)
+                _wakeup.clear()
+            db.session.remove()
+
+
+@job('order_confirmation')
+def send_order_confirmation(order_id):
+    # placeholder until a mail provider is wired in
+    logger.info("Order confirmation sent for order %s", order_id)
+
+
+if __name__ == '__main__':
+    # go through the imported module so handlers registered by app.py and
+    # friends land in the same registry the workers read from
+    import jobs
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    pool = jobs.WorkerPool(app, threads=int(os.environ.get('JOB_WORKERS', 2)))
+    pool.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pool.stop()
@@ -0,0 +1,254 @@
+# maintenance.py
+# Online upkeep of the SQLite database, run by a background thread next to
+# waitress (see app.py) while the app keeps serving.
+#
+#   optimize            PRAGMA optimize, and a full ANALYZE the first time, so
+#                       the query planner has statistics
+#   incremental_vacuum  hand up to VACUUM_PAGES free pages back to the OS
+#   checkpoint          copy the WAL back into the database; truncate it once
+#                       it grows past WAL_SIZE_CAP
+#   backup              copy the live database with the backup API in one
+#                       step, keeping BACKUP_KEEP copies
+#
+# Each task's last duration and result are kept in memory and served from
+# /admin/maintenance.
+#
+# Incremental vacuum needs auto_vacuum=INCREMENTAL, which an existing file
+# only picks up through a full VACUUM. Run it once while traffic is low:
+#   python maintenance.py enable-incremental-vacuum
+#   python maintenance.py run backup     # any task, right now
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+OPTIMIZE_INTERVAL = 3600
+VACUUM_INTERVAL = 600
+CHECKPOINT_INTERVAL = 60
+BACKUP_INTERVAL = 24 * 3600
+
+VACUUM_PAGES = 2000
+WAL_SIZE_CAP = 64 * 1024 * 1024
+BACKUP_KEEP = 7
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class Maintenance:
+    def __init__(self):
+        self.app = None
+        self.db = None
+        self.path = None
+        self.backup_dir = None
+        self.tasks = {}
+        self.stats = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        with app.app_context():
+            if db.engine.dialect.name != 'sqlite' or db.engine.url.database in (None, '', ':memory:'):
+                return
+            self.path = db.engine.url.database
+            event.listen(db.engine, 'connect', self._configure_connection)
+        self.backup_dir = app.config.get('BACKUP_DIR') or os.path.join(app.instance_path, 'backups')
+        self.tasks = {
+            'optimize': (self.optimize, OPTIMIZE_INTERVAL),
+            'incremental_vacuum': (self.incremental_vacuum, VACUUM_INTERVAL),
+            'checkpoint': (self.checkpoint, CHECKPOINT_INTERVAL),
+            'backup': (self.backup, BACKUP_INTERVAL),
+        }
+        self.stats = {name: {'interval': interval, 'runs': 0, 'failures': 0} for name, (_, interval) in self.tasks.items()}
+
+    @property
+    def enabled(self):
+        return bool(self.tasks)
+
+    def _configure_connection(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers run during writes, checkpoints and backups;
+        # journal_size_limit trims the WAL file after each checkpoint
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA journal_size_limit=%d' % WAL_SIZE_CAP)
+        cursor.close()
+
+    def _raw(self):
+        # the sqlite3 connection underneath a pooled one
+        return self.db.engine.raw_connection()
+
+    def _pragma(self, connection, statement):
+        return connection.driver_connection.execute('PRAGMA ' + statement).fetchall()
+
+    def optimize(self):
+        connection = self._raw()
+        try:
+            analyzed = False
+            has_stats = connection.driver_connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+            ).fetchone()
+            if not has_stats:
+                connection.driver_connection.execute('ANALYZE')
+                analyzed = True
+            self._pragma(connection, 'optimize')
+            connection.driver_connection.commit()
+            stat_rows = connection.driver_connection.execute('SELECT count(*) FROM sqlite_stat1').fetchone()[0]
+        finally:
+            connection.close()
+        return {'full_analyze': analyzed, 'stat_rows': stat_rows}
+
+    def incremental_vacuum(self):
+        connection = self._raw()
+        try:
+            if self._pragma(connection, 'auto_vacuum')[0][0] != 2:
+                return {'skipped': 'auto_vacuum is not INCREMENTAL'}
+            before = self._pragma(connection, 'freelist_count')[0][0]
+            size_before = _file_size(self.path)
+            # frees one page per step; executescript steps it to the end
+            connection.driver_connection.executescript('PRAGMA incremental_vacuum(%d)' % VACUUM_PAGES)
+            after = self._pragma(connection, 'freelist_count')[0][0]
+        finally:
+            connection.close()
+        # in WAL mode the file itself shrinks at the next checkpoint
+        return {
+            'pages_freed': before - after,
+            'free_pages_left': after,
+            'bytes_reclaimed': size_before - _file_size(self.path),
+        }
+
+    def checkpoint(self):
+        wal_path = self.path + '-wal'
+        wal_before = _file_size(wal_path)
+        mode = 'TRUNCATE' if wal_before > WAL_SIZE_CAP else 'PASSIVE'
+        connection = self._raw()
+        try:
+            busy, log_frames, checkpointed = self._pragma(connection, 'wal_checkpoint(%s)' % mode)[0]
+        finally:
+            connection.close()
+        return {
+            'mode': mode,
+            'busy': bool(busy),
+            'wal_frames': log_frames,
+            'frames_checkpointed': checkpointed,
+            'wal_bytes_before': wal_before,
+            'wal_bytes_after': _file_size(wal_path),
+        }
+
+    def backup(self):
+        import sqlite3
+
+        os.makedirs(self.backup_dir, exist_ok=True)
+        name = 'data-%s.db' % datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        target_path = os.path.join(self.backup_dir, name)
+        partial_path = target_path + '.partial'
+
+        source = self._raw()
+        target = sqlite3.connect(partial_path)
+        try:
+            # one step copies from a single WAL read snapshot, which writers
+            # do not wait for; copying in several steps would start over
+            # after every write from another connection
+            source.driver_connection.backup(target, pages=-1)
+        finally:
+            target.close()
+            source.close()
+        os.replace(partial_path, target_path)
+
+        backups = sorted(entry for entry in os.listdir(self.backup_dir) if entry.startswith('data-') and entry.endswith('.db'))
+        for old in backups[:-BACKUP_KEEP]:
+            os.remove(os.path.join(self.backup_dir, old))
+        return {'path': target_path, 'bytes': _file_size(target_path)}
+
+    def run(self, name):
+        """Run one task now and record its stats. Returns the task's result."""
+        func, _ = self.tasks[name]
+        started = time.monotonic()
+        stats = self.stats[name]
+        with self._lock:
+            stats['last_run'] = datetime.utcnow().isoformat()
+        try:
+            with self.app.app_context():
+                result = func()
+        except Exception as exc:
+            logger.exception("Maintenance task %s failed", name)
+            with self._lock:
+                stats['failures'] += 1
+                stats['last_error'] = "%s: %s" % (type(exc).__name__, exc)
+            result = None
+        else:
+            with self._lock:
+                stats['last_result'] = result
+                stats['last_error'] = None
+        with self._lock:
+            stats['runs'] += 1
+            stats['last_duration_ms'] = round((time.monotonic() - started) * 1000, 1)
+        return result
+
+    def status(self):
+        with self._lock:
+            return {name: dict(stats) for name, stats in self.stats.items()}
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _loop(self):
+        now = time.monotonic()
+        due = {name: now + interval for name, (_, interval) in self.tasks.items()}
+        while not self._stop.is_set():
+            name = min(due, key=due.get)
+            if self._stop.wait(max(0.0, due[name] - time.monotonic())):
+                break
+            self.run(name)
+            due[name] = time.monotonic() + self.tasks[name][1]
+
+    def enable_incremental_vacuum(self):
+        # a full VACUUM rewrites the file and blocks writers while it runs
+        with self.app.app_context():
+            connection = self._raw()
+            try:
+                self._pragma(connection, 'auto_vacuum=INCREMENTAL')
+                connection.driver_connection.execute('VACUUM')
+            finally:
+                connection.close()
+
+
+maintenance = Maintenance()
+
+
+if __name__ == '__main__':
+    import json
+    import sys
+
+    from app import app
+    # the app configured the instance imported as `maintenance`, not __main__'s
+    from maintenance import maintenance
+
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] == ['enable-incremental-vacuum']:
+        maintenance.enable_incremental_vacuum()
+    elif len(sys.argv) == 3 and sys.argv[1] == 'run' and sys.argv[2] in maintenance.tasks:
+        print(json.dumps(maintenance.run(sys.argv[2]), indent=2))
+    else:
+        sys.exit("usage: python maintenance.py enable-incremental-vacuum | run %s" % '|'.join(maintenance.tasks))
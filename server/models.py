@@ -1,21 +1,41 @@
 # models.py
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import MetaData
-from sqlalchemy_serializer import SerializerMixin
-from flask_bcrypt import Bcrypt
-from sqlalchemy.orm import validates
+from sqlalchemy import MetaData, func, select
+from sqlalchemy.orm import column_property, validates
+from routing import RoutingSession
+from datetime import datetime
+import json
+
+# bcrypt is only needed when passwords are hashed or checked, so the
+# extension is imported on first use instead of at startup
+_bcrypt = None
+
+def get_bcrypt():
+    global _bcrypt
+    if _bcrypt is None:
+        from flask_bcrypt import Bcrypt
+        _bcrypt = Bcrypt()
+    return _bcrypt
 
-bcrypt = Bcrypt()
 metadata = MetaData()
-db = SQLAlchemy(metadata=metadata)
+db = SQLAlchemy(metadata=metadata, session_options={'class_': RoutingSession})
 
-class UserModel(db.Model, SerializerMixin):
+def live(model, row_id):
+    """Get a user or product by id, treating a tombstoned one as missing."""
+    row = db.session.get(model, row_id)
+    if row is None or row.deleted_at is not None:
+        return None
+    return row
+
+class UserModel(db.Model):
     __tablename__ = 'user'
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
+    # set by DELETE; the row reads as gone until purge.py removes it
+    deleted_at = db.Column(db.DateTime, nullable=True)
     cart = db.relationship('cartModel', backref='user', lazy=True)
 
     def __init__(self, username, email, password):
@@ -24,10 +44,10 @@ class UserModel(db.Model, SerializerMixin):
         self.set_password(password)
 
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = get_bcrypt().generate_password_hash(password).decode('utf-8')
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return get_bcrypt().check_password_hash(self.password_hash, password)
 
     def to_dict(self):
         return {
@@ -51,13 +71,19 @@ class UserModel(db.Model, SerializerMixin):
             raise ValueError("Invalid email address.")
         return email
 
-class ProductModel(db.Model, SerializerMixin):
+class ProductModel(db.Model):
     __tablename__ = 'product'
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=True, nullable=False)
     price = db.Column(db.Float, nullable=False)
+    # the live count is spread over product_stock_slot rows (see inventory.py);
+    # this caches their total and is refreshed by the rebalancer, not per order
     stock = db.Column(db.Integer, nullable=False)
+    # set by DELETE; the row reads as gone until purge.py removes it
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
     cart = db.relationship('cartModel', backref='product', lazy=True)
 
     def __init__(self, name, price, stock=0):
@@ -93,6 +119,26 @@ class ProductModel(db.Model, SerializerMixin):
             raise ValueError("Stock cannot be negative.")
         return stock
 
+class ProductStockSlotModel(db.Model):
+    # one sub-counter of a product's stock, see inventory.py
+    __tablename__ = 'product_stock_slot'
+
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True, autoincrement=False)
+    slot = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    quantity = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<ProductStockSlot %r #%r>' % (self.product_id, self.slot)
+
+# the exact stock, summed over the slots; deferred, so only queried when read
+ProductModel.available = column_property(
+    select(func.coalesce(func.sum(ProductStockSlotModel.quantity), 0))
+    .where(ProductStockSlotModel.product_id == ProductModel.id)
+    .correlate_except(ProductStockSlotModel)
+    .scalar_subquery(),
+    deferred=True,
+)
+
 class cartModel(db.Model):
     __tablename__ = 'cart'
 
@@ -100,6 +146,8 @@ class cartModel(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
 
     def __init__(self, user_id, product_id, quantity):
         self.user_id = user_id
@@ -160,6 +208,12 @@ class OrderModel(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=db.func.current_timestamp())
+    # running totals over the order's items, kept in step by the order item endpoints
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total = db.Column(db.Float, nullable=False, default=0.0, server_default='0')
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
 
     def __init__(self, user_id, product_id, quantity):
         self.user_id = user_id
@@ -171,7 +225,9 @@ class OrderModel(db.Model):
             'id': self.id,
             'user_id': self.user_id,
             'product_id': self.product_id,
-            'quantity': self.quantity
+            'quantity': self.quantity,
+            'item_count': self.item_count,
+            'total': self.total
         }
 
     def __repr__(self):
@@ -190,19 +246,23 @@ class OrderItemModel(db.Model):
     order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
+    # the product's price when the item was ordered
+    unit_price = db.Column(db.Float)
 
     def to_dict(self):
         return {
             'id': self.id,
             'order_id': self.order_id,
             'product_id': self.product_id,
-            'quantity': self.quantity
+            'quantity': self.quantity,
+            'unit_price': self.unit_price
         }
 
-    def __init__(self, order_id, product_id, quantity):
+    def __init__(self, order_id, product_id, quantity, unit_price=None):
         self.order_id = order_id
         self.product_id = product_id
         self.quantity = quantity
+        self.unit_price = unit_price
 
     def __repr__(self):
         return '<OrderItem %r>' % self.id
@@ -221,6 +281,8 @@ class ReviewModel(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     rating = db.Column(db.Integer, nullable=False)
     comment = db.Column(db.Text, nullable=True)
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
+    __mapper_args__ = {'version_id_col': version_id}
 
     def to_dict(self):
         return {
@@ -245,3 +307,194 @@ class ReviewModel(db.Model):
         if rating < 1 or rating > 5:
             raise ValueError("Rating must be between 1 and 5.")
         return rating
+
+class JobModel(db.Model):
+    __tablename__ = 'job'
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(80), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __init__(self, name, payload='{}', max_attempts=5, run_at=None):
+        self.name = name
+        self.payload = payload
+        self.max_attempts = max_attempts
+        self.run_at = run_at or datetime.utcnow()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'payload': json.loads(self.payload),
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_at': self.run_at.isoformat() if self.run_at else None,
+            'locked_by': self.locked_by,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    def __repr__(self):
+        return '<Job %r %r>' % (self.id, self.name)
+
+class ChangeModel(db.Model):
+    __tablename__ = 'change'
+    # AUTOINCREMENT so a sequence number is never handed out twice
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    seq = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(40), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    version = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'table': self.table_name,
+            'id': self.row_id,
+            'op': self.op,
+            'version': self.version
+        }
+
+    def __repr__(self):
+        return '<Change %r>' % self.seq
+
+class ShardMapModel(db.Model):
+    __tablename__ = 'shard_map'
+
+    bucket = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    shard = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, bucket, shard):
+        self.bucket = bucket
+        self.shard = shard
+
+    def __repr__(self):
+        return '<ShardMap %r -> %r>' % (self.bucket, self.shard)
+
+class IdSequenceModel(db.Model):
+    __tablename__ = 'id_sequence'
+
+    name = db.Column(db.String(40), primary_key=True)
+    next_value = db.Column(db.Integer, nullable=False, default=1)
+
+    def __init__(self, name, next_value=1):
+        self.name = name
+        self.next_value = next_value
+
+    def __repr__(self):
+        return '<IdSequence %r>' % self.name
+
+class ArchiveRangeModel(db.Model):
+    __tablename__ = 'archive_range'
+
+    id = db.Column(db.Integer, primary_key=True)
+    min_order_id = db.Column(db.Integer, nullable=False)
+    max_order_id = db.Column(db.Integer, nullable=False)
+    min_order_item_id = db.Column(db.Integer, nullable=True)
+    max_order_item_id = db.Column(db.Integer, nullable=True)
+    order_count = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'min_order_id': self.min_order_id,
+            'max_order_id': self.max_order_id,
+            'min_order_item_id': self.min_order_item_id,
+            'max_order_item_id': self.max_order_item_id,
+            'order_count': self.order_count,
+            'archived_at': self.archived_at.isoformat() if self.archived_at else None
+        }
+
+    def __repr__(self):
+        return '<ArchiveRange %r-%r>' % (self.min_order_id, self.max_order_id)
+
+class WatermarkModel(db.Model):
+    __tablename__ = 'watermark'
+
+    name = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, name, value=0):
+        self.name = name
+        self.value = value
+
+    def __repr__(self):
+        return '<Watermark %r = %r>' % (self.name, self.value)
+
+class ProductPairModel(db.Model):
+    # how many orders contained both products; stored in both directions
+    __tablename__ = 'product_pair'
+
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    other_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<ProductPair %r %r>' % (self.product_id, self.other_id)
+
+class RecommendationModel(db.Model):
+    # the top pairs per product, in rank order
+    __tablename__ = 'recommendation'
+
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    recommended_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<Recommendation %r #%r>' % (self.product_id, self.rank)
+
+class PurgeModel(db.Model):
+    # progress of removing a deleted user or product and its dependent rows
+    __tablename__ = 'purge'
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(40), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    step = db.Column(db.Integer, nullable=False, default=0)
+    stage = db.Column(db.String(40), nullable=True)
+    rows_deleted = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __init__(self, table_name, row_id):
+        self.table_name = table_name
+        self.row_id = row_id
+        self.status = 'queued'
+        self.step = 0
+        self.rows_deleted = 0
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'table': self.table_name,
+            'row_id': self.row_id,
+            'status': self.status,
+            'step': self.step,
+            'stage': self.stage,
+            'rows_deleted': self.rows_deleted,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+    def __repr__(self):
+        return '<Purge %r %r %r>' % (self.id, self.table_name, self.row_id)
@@ -0,0 +1,197 @@
+# purge.py
+# Background removal of deleted users and products.
+#
+# DELETE /users/<id> and /products/<id> only stamp `deleted_at`, which hides
+# the row from reads at once, record a row in `purge` and enqueue the purge
+# job. The job works through the dependent tables in foreign key order
+# (cart items, carts, order items, orders, reviews, ...) and removes the
+# tombstoned row itself last. Every batch selects at most BATCH_SIZE primary
+# keys and deletes them in one short transaction, and the purge row records
+# which step it is on and how many rows are gone (see /admin/purges).
+#
+# A batch only deletes what its own select found, so a retried job, or two
+# workers on the same purge, simply carry on from what is left. Hot deletes
+# are logged in the change feed like API deletes. Archived orders of the
+# user or product are removed from the archive database too.
+#
+#   python purge.py <purge id>     # or enqueue('purge', purge_id=...)
+import logging
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import bindparam, delete, or_, select, tuple_, update
+
+import archive
+from changes import TRACKED_TABLES
+from jobs import enqueue, job
+from models import (
+    db, UserModel, ProductModel, cartModel, cartItemModel, OrderModel, OrderItemModel, ReviewModel,
+    ProductPairModel, ProductStockSlotModel, RecommendationModel, ChangeModel, PurgeModel,
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# pause between batches so foreground writers can take the write lock
+BATCH_PAUSE = 0.05
+# a run re-enqueues itself after this long, well inside the job lease
+RUN_SECONDS = 60
+
+# `archived` steps run against the archive bind; `adjust_totals` steps remove
+# items from orders that stay, so those orders' running totals come down
+Step = namedtuple('Step', 'table condition archived adjust_totals')
+
+CARTS = cartModel.__table__
+CART_ITEMS = cartItemModel.__table__
+ORDERS = OrderModel.__table__
+ORDER_ITEMS = OrderItemModel.__table__
+REVIEWS = ReviewModel.__table__
+
+
+def user_steps(user_id):
+    carts = select(CARTS.c.id).where(CARTS.c.user_id == user_id)
+    orders = select(ORDERS.c.id).where(ORDERS.c.user_id == user_id)
+    steps = [
+        Step(CART_ITEMS, CART_ITEMS.c.cart_id.in_(carts), False, False),
+        Step(CARTS, CARTS.c.user_id == user_id, False, False),
+    ]
+    for archived in (False, True):
+        steps += [
+            Step(ORDER_ITEMS, ORDER_ITEMS.c.order_id.in_(orders), archived, False),
+            Step(ORDERS, ORDERS.c.user_id == user_id, archived, False),
+        ]
+    users = UserModel.__table__
+    return steps + [
+        Step(REVIEWS, REVIEWS.c.user_id == user_id, False, False),
+        Step(users, (users.c.id == user_id) & users.c.deleted_at.isnot(None), False, False),
+    ]
+
+
+def product_steps(product_id):
+    carts = select(CARTS.c.id).where(CARTS.c.product_id == product_id)
+    orders = select(ORDERS.c.id).where(ORDERS.c.product_id == product_id)
+    pairs = ProductPairModel.__table__
+    recommended = RecommendationModel.__table__
+    slots = ProductStockSlotModel.__table__
+    steps = [
+        Step(CART_ITEMS, or_(CART_ITEMS.c.product_id == product_id, CART_ITEMS.c.cart_id.in_(carts)), False, False),
+        Step(CARTS, CARTS.c.product_id == product_id, False, False),
+    ]
+    for archived in (False, True):
+        steps += [
+            Step(ORDER_ITEMS, ORDER_ITEMS.c.order_id.in_(orders), archived, False),
+            Step(ORDER_ITEMS, ORDER_ITEMS.c.product_id == product_id, archived, True),
+            Step(ORDERS, ORDERS.c.product_id == product_id, archived, False),
+        ]
+    products = ProductModel.__table__
+    return steps + [
+        Step(REVIEWS, REVIEWS.c.product_id == product_id, False, False),
+        Step(slots, slots.c.product_id == product_id, False, False),
+        Step(recommended, or_(recommended.c.product_id == product_id, recommended.c.recommended_id == product_id), False, False),
+        Step(pairs, or_(pairs.c.product_id == product_id, pairs.c.other_id == product_id), False, False),
+        Step(products, (products.c.id == product_id) & products.c.deleted_at.isnot(None), False, False),
+    ]
+
+
+STEPS = {'user': user_steps, 'product': product_steps}
+
+
+def subtract_totals(connection, rows):
+    # rows are (id, order_id, quantity, unit_price) of deleted order items
+    totals = {}
+    for _, order_id, quantity, unit_price in rows:
+        count, amount = totals.get(order_id, (0, 0.0))
+        totals[order_id] = (count + quantity, amount + quantity * (unit_price or 0))
+    connection.execute(
+        update(ORDERS).where(ORDERS.c.id == bindparam('order'))
+        .values(
+            item_count=ORDERS.c.item_count - bindparam('count'),
+            total=ORDERS.c.total - bindparam('amount'),
+            version_id=ORDERS.c.version_id + 1,
+        ),
+        [{'order': order_id, 'count': count, 'amount': amount} for order_id, (count, amount) in totals.items()],
+    )
+    return list(totals)
+
+
+def delete_batch(connection, step, batch_size=BATCH_SIZE):
+    """Delete up to batch_size rows matching one step. Returns (deleted keys, orders updated)."""
+    table = step.table
+    key = list(table.primary_key.columns)
+    columns = key + ([table.c.order_id, table.c.quantity, table.c.unit_price] if step.adjust_totals else [])
+    rows = connection.execute(select(*columns).where(step.condition).limit(batch_size)).all()
+    if not rows:
+        return [], []
+    if len(key) == 1:
+        keys = [row[0] for row in rows]
+        match = key[0].in_(keys)
+    else:
+        keys = [tuple(row[:len(key)]) for row in rows]
+        match = tuple_(*key).in_(keys)
+    connection.execute(delete(table).where(match))
+    updated = subtract_totals(connection, rows) if step.adjust_totals else []
+    return keys, updated
+
+
+def log_changes(step, keys, updated):
+    rows = []
+    if step.table.name in TRACKED_TABLES:
+        rows += [{'table_name': step.table.name, 'row_id': key, 'op': 'delete', 'version': None} for key in keys]
+    rows += [{'table_name': ORDERS.name, 'row_id': order_id, 'op': 'update', 'version': None} for order_id in updated]
+    if rows:
+        db.session.execute(ChangeModel.__table__.insert(), rows)
+        # wakes /changes long-polls on commit, see changes.py
+        db.session.info['changes_pending'] = True
+
+
+def run_step(step, batch_size):
+    if not step.archived:
+        keys, updated = delete_batch(db.session.connection(), step, batch_size)
+        log_changes(step, keys, updated)
+        return len(keys)
+    if not archive.has_archive():
+        return 0
+    with archive.archive_engine().begin() as connection:
+        keys, _ = delete_batch(connection, step, batch_size)
+    return len(keys)
+
+
+@job('purge', max_attempts=10)
+def purge(purge_id, batch_size=BATCH_SIZE, run_seconds=RUN_SECONDS):
+    record = db.session.get(PurgeModel, purge_id)
+    if record is None or record.status == 'done':
+        return
+    steps = STEPS[record.table_name](record.row_id)
+    deadline = time.monotonic() + run_seconds
+    record.status = 'running'
+    while record.step < len(steps):
+        step = steps[record.step]
+        record.stage = ('archived_' if step.archived else '') + step.table.name
+        deleted = run_step(step, batch_size)
+        record.rows_deleted += deleted
+        if deleted < batch_size:
+            record.step += 1
+        record.updated_at = datetime.utcnow()
+        db.session.commit()
+        if time.monotonic() > deadline and record.step < len(steps):
+            # give the worker back; a fresh job continues from record.step
+            enqueue('purge', purge_id=purge_id)
+            db.session.commit()
+            return
+        time.sleep(BATCH_PAUSE)
+    record.status = 'done'
+    record.stage = None
+    record.finished_at = record.updated_at = datetime.utcnow()
+    db.session.commit()
+    logger.info("Purged %s %d: %d rows", record.table_name, record.row_id, record.rows_deleted)
+
+
+if __name__ == '__main__':
+    import sys
+
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        purge(int(sys.argv[1]))
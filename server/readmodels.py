@@ -0,0 +1,80 @@
+# readmodels.py
+# Read-only query layer for the list endpoints.
+#
+# Selecting plain columns skips the identity map, attribute instrumentation
+# and @validates hooks that full model instances carry, and the rows come
+# back as slotted namedtuples that serialize with the same keys as the
+# models' to_dict().
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from models import db, ProductModel, OrderModel, OrderItemModel, ReviewModel
+
+
+class ProductRow(namedtuple('ProductRow', 'id name price')):
+    __slots__ = ()
+
+    def to_dict(self):
+        return self._asdict()
+
+
+class OrderRow(namedtuple('OrderRow', 'id user_id product_id quantity item_count total')):
+    __slots__ = ()
+
+    def to_dict(self):
+        return self._asdict()
+
+
+class OrderItemRow(namedtuple('OrderItemRow', 'id order_id product_id quantity unit_price')):
+    __slots__ = ()
+
+    def to_dict(self):
+        return self._asdict()
+
+
+class ReviewRow(namedtuple('ReviewRow', 'id user_id product_id rating comment')):
+    __slots__ = ()
+
+    def to_dict(self):
+        return self._asdict()
+
+
+def _columns(model, row_type):
+    return [getattr(model, field) for field in row_type._fields]
+
+
+def _fetch(row_type, statement):
+    make = row_type._make
+    # Row is a tuple subclass, so _make() takes it as is
+    return [make(row) for row in db.session.execute(statement)]
+
+
+# tombstoned products stay hidden while purge.py removes them
+PRODUCTS = select(*_columns(ProductModel, ProductRow)).where(ProductModel.deleted_at.is_(None)).order_by(ProductModel.id)
+ORDERS = select(*_columns(OrderModel, OrderRow)).order_by(OrderModel.id)
+ORDER_ITEMS = select(*_columns(OrderItemModel, OrderItemRow)).order_by(OrderItemModel.id)
+REVIEWS = select(*_columns(ReviewModel, ReviewRow)).order_by(ReviewModel.id)
+
+
+def list_products():
+    return _fetch(ProductRow, PRODUCTS)
+
+
+def list_orders():
+    return _fetch(OrderRow, ORDERS)
+
+
+def list_order_items():
+    return _fetch(OrderItemRow, ORDER_ITEMS)
+
+
+def list_reviews():
+    return _fetch(ReviewRow, REVIEWS)
+
+
+def warm():
+    # run each list statement once, reading a single row, so the first real
+    # request finds it in the compiled cache and a pooled connection ready
+    for statement in (PRODUCTS, ORDERS, ORDER_ITEMS, REVIEWS):
+        db.session.execute(statement).first()
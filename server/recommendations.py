@@ -0,0 +1,147 @@
+# recommendations.py
+# Precomputed "frequently bought together" lists.
+#
+# refresh() reads the order items of orders placed since its last run, turns
+# them into a sparse order x product matrix A and adds the co-occurrence
+# counts AᵀA to the running totals in `product_pair`. It then rewrites the
+# TOP_K rows in `recommendation` for each product that gained a pair, so
+# the API reads a product's list with one primary-key range scan.
+#
+# Progress is the last processed order id in the `watermark` table, advanced
+# in the same transaction as the counts, so an interrupted run picks up where
+# it stopped. Items added to an order after it was processed are not counted.
+#
+# Worker pools start the repeating refresh job (see jobs.recurring), which
+# then runs every REFRESH_INTERVAL seconds.
+#
+#   python recommendations.py      # refresh once
+import importlib
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+
+from jobs import enqueue, job, recurring
+from models import db, OrderModel, OrderItemModel, ProductModel, ProductPairModel, RecommendationModel, WatermarkModel
+
+logger = logging.getLogger(__name__)
+
+TOP_K = 10
+# orders per transaction
+ORDER_CHUNK = 5000
+# orders younger than this may still be gaining items
+SETTLE_TIME = timedelta(minutes=10)
+WATERMARK = 'recommendations'
+# products per IN (...) when reading pair counts back
+IN_CHUNK = 500
+# seconds between runs of the repeating refresh job
+REFRESH_INTERVAL = 300
+
+
+def recommendations_for(product_id, limit=TOP_K):
+    return db.session.execute(
+        select(ProductModel.id, ProductModel.name, ProductModel.price, RecommendationModel.score)
+        .join(ProductModel, ProductModel.id == RecommendationModel.recommended_id)
+        .where(RecommendationModel.product_id == product_id, ProductModel.deleted_at.is_(None))
+        .order_by(RecommendationModel.rank)
+        .limit(limit)
+    ).all()
+
+
+def cooccurrence(order_ids, product_ids):
+    """Return (product, other, count) arrays for the pairs bought together in these orders."""
+    import numpy as np
+    from scipy import sparse
+
+    orders = np.unique(order_ids, return_inverse=True)[1]
+    products = np.asarray(product_ids)
+    incidence = sparse.coo_matrix(
+        (np.ones(len(products), dtype=np.int64), (orders, products)),
+        shape=(orders.max() + 1, products.max() + 1),
+    ).tocsr()
+    # a product listed twice in one order still counts once
+    incidence.data[:] = 1
+    counts = (incidence.T @ incidence).tocoo()
+    pairs = counts.row != counts.col
+    return counts.row[pairs], counts.col[pairs], counts.data[pairs]
+
+
+def add_counts(products, others, counts):
+    # upsert: SQLite and PostgreSQL both spell it ON CONFLICT ... DO UPDATE
+    dialect = importlib.import_module('sqlalchemy.dialects.%s' % db.session.get_bind().dialect.name)
+    statement = dialect.insert(ProductPairModel)
+    statement = statement.on_conflict_do_update(
+        index_elements=[ProductPairModel.product_id, ProductPairModel.other_id],
+        set_={'count': ProductPairModel.count + statement.excluded['count']},
+    )
+    db.session.execute(statement, [
+        {'product_id': product, 'other_id': other, 'count': count}
+        for product, other, count in zip(products.tolist(), others.tolist(), counts.tolist())
+    ])
+
+
+def rebuild_top_k(product_ids, k=TOP_K):
+    import numpy as np
+
+    for start in range(0, len(product_ids), IN_CHUNK):
+        chunk = product_ids[start:start + IN_CHUNK]
+        rows = db.session.execute(
+            select(ProductPairModel.product_id, ProductPairModel.other_id, ProductPairModel.count)
+            .where(ProductPairModel.product_id.in_(chunk))
+        ).all()
+        products, others, counts = (np.array(column, dtype=np.int64) for column in zip(*rows))
+        # per product: highest count first, lower id breaks ties
+        order = np.lexsort((others, -counts, products))
+        products, others, counts = products[order], others[order], counts[order]
+        group_start = np.searchsorted(products, products)
+        ranks = np.arange(len(products)) - group_start
+        keep = ranks < k
+
+        db.session.execute(delete(RecommendationModel).where(RecommendationModel.product_id.in_(chunk)))
+        db.session.execute(insert(RecommendationModel), [
+            {'product_id': product, 'rank': rank, 'recommended_id': other, 'score': count}
+            for product, rank, other, count in zip(
+                products[keep].tolist(), ranks[keep].tolist(), others[keep].tolist(), counts[keep].tolist()
+            )
+        ])
+
+
+@job('refresh_recommendations', max_attempts=3)
+def refresh(chunk_size=ORDER_CHUNK, repeat=False):
+    cutoff = datetime.utcnow() - SETTLE_TIME
+    last_order = db.session.query(func.max(OrderModel.id)).filter(OrderModel.created_at < cutoff).scalar() or 0
+    watermark = db.session.get(WatermarkModel, WATERMARK)
+    if watermark is None:
+        watermark = WatermarkModel(WATERMARK)
+        db.session.add(watermark)
+    start = watermark.value
+    while watermark.value < last_order:
+        low, high = watermark.value, min(watermark.value + chunk_size, last_order)
+        items = db.session.execute(
+            select(OrderItemModel.order_id, OrderItemModel.product_id)
+            .where(OrderItemModel.order_id > low, OrderItemModel.order_id <= high)
+        ).all()
+        if items:
+            products, others, counts = cooccurrence(*zip(*items))
+            if len(products):
+                add_counts(products, others, counts)
+                rebuild_top_k(sorted(set(products.tolist())))
+        watermark.value = high
+        db.session.commit()
+    db.session.commit()
+    logger.info("Recommendations: processed orders %d-%d", start + 1, watermark.value)
+    if repeat:
+        enqueue('refresh_recommendations', delay=REFRESH_INTERVAL, repeat=True)
+        db.session.commit()
+    return watermark.value
+
+
+recurring('refresh_recommendations', repeat=True)
+
+
+if __name__ == '__main__':
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        refresh()
@@ -0,0 +1,151 @@
+# routing.py
+# Optional read-replica routing.
+#
+# With DATABASE_REPLICA_URLS set (comma separated), GET/HEAD requests read
+# from a healthy replica and everything else goes to the primary. A client
+# that has just written keeps reading from the primary for
+# READ_YOUR_WRITES_SECONDS so it always sees its own changes. Replicas that
+# fail a health check or raise connection errors are skipped until the next
+# successful check.
+#
+# To try it locally with SQLite files:
+#   DATABASE_REPLICA_URLS=sqlite:///replica-1.db,sqlite:///replica-2.db python routing.py sync
+#   DATABASE_REPLICA_URLS=... python app.py
+import itertools
+import logging
+import threading
+import time
+
+from flask import has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class ReplicaRouter:
+    def __init__(self):
+        self.app = None
+        self.db = None
+        self.replicas = []
+        self.window = 0
+        self.health_interval = 0
+        self._health = {}
+        self._last_write = {}
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+
+    def init_app(self, app, db):
+        self.app = app
+        self.db = db
+        self.replicas = list(app.config.get('SQLALCHEMY_REPLICAS', []))
+        self.window = app.config.get('READ_YOUR_WRITES_SECONDS', 5.0)
+        self.health_interval = app.config.get('REPLICA_HEALTH_INTERVAL', 10.0)
+        if not self.replicas:
+            return
+        with app.app_context():
+            for key in self.replicas:
+                self._health[key] = (True, 0.0)
+                event.listen(db.engines[key], 'handle_error', self._on_error(key))
+        app.after_request(self._remember_write)
+
+    def _on_error(self, key):
+        def mark_unhealthy(context):
+            if context.is_disconnect or context.connection is None:
+                logger.warning("Replica %s failed, routing reads to the primary", key)
+                self._health[key] = (False, time.monotonic())
+        return mark_unhealthy
+
+    def client_key(self):
+        return request.headers.get('X-Client-Id') or request.remote_addr
+
+    def _remember_write(self, response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            now = time.monotonic()
+            with self._lock:
+                self._last_write[self.client_key()] = now
+                # forget clients whose window has passed
+                if len(self._last_write) > 10000:
+                    self._last_write = {
+                        client: at for client, at in self._last_write.items() if now - at < self.window
+                    }
+        return response
+
+    def recently_wrote(self):
+        last = self._last_write.get(self.client_key())
+        return last is not None and time.monotonic() - last < self.window
+
+    def is_healthy(self, key):
+        healthy, checked_at = self._health[key]
+        if time.monotonic() - checked_at < self.health_interval:
+            return healthy
+        try:
+            with self.db.engines[key].connect() as connection:
+                connection.execute(text('SELECT 1'))
+            healthy = True
+        except Exception:
+            logger.warning("Replica %s failed its health check", key)
+            healthy = False
+        self._health[key] = (healthy, time.monotonic())
+        return healthy
+
+    def choose_replica(self):
+        """Return the bind key of a replica for this request, or None for the primary."""
+        if not self.replicas or not has_request_context():
+            return None
+        if request.method not in READ_METHODS or self.recently_wrote():
+            return None
+        start = next(self._next)
+        for offset in range(len(self.replicas)):
+            key = self.replicas[(start + offset) % len(self.replicas)]
+            if self.is_healthy(key):
+                return key
+        return None
+
+    def status(self):
+        return {key: self._health[key][0] for key in self.replicas}
+
+
+router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # a session opened on one connection (atomic batches) stays on it
+        if bind is None and isinstance(self.bind, Connection):
+            return self.bind
+        # flushes are writes and always go to the primary
+        if bind is None and not self._flushing:
+            key = router.choose_replica()
+            if key is not None:
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def sync_sqlite_replicas(app, db):
+    # stand-in for real replication when the replicas are local SQLite files
+    with app.app_context():
+        primary = db.engine.raw_connection()
+        try:
+            for key in app.config.get('SQLALCHEMY_REPLICAS', []):
+                replica = db.engines[key].raw_connection()
+                try:
+                    primary.driver_connection.backup(replica.driver_connection)
+                finally:
+                    replica.close()
+        finally:
+            primary.close()
+
+
+if __name__ == '__main__':
+    import sys
+
+    from app import app
+    from models import db
+
+    if sys.argv[1:] != ['sync']:
+        sys.exit("usage: python routing.py sync")
+    sync_sqlite_replicas(app, db)
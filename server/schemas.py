@@ -0,0 +1,154 @@
+# schemas.py
+# Request body schemas.
+#
+# Each body is a msgspec Struct. decode() parses the raw request bytes and
+# checks required fields, types and value constraints in one pass, and the
+# decoder for each schema is built once when this module is imported. A body
+# that does not match becomes a 400 with the offending field named:
+#
+#   {"error": "Invalid request body", "field": "quantity", "detail": "Expected `int` >= 1"}
+import re
+from typing import Any, Dict, List, Optional
+
+try:
+    from typing import Annotated
+except ImportError:  # Python 3.8
+    from typing_extensions import Annotated
+
+import msgspec
+from flask import request
+from werkzeug.exceptions import BadRequest
+
+Id = Annotated[int, msgspec.Meta(ge=1)]
+Quantity = Annotated[int, msgspec.Meta(ge=1)]
+Price = Annotated[float, msgspec.Meta(gt=0)]
+Stock = Annotated[int, msgspec.Meta(ge=0)]
+Rating = Annotated[int, msgspec.Meta(ge=1, le=5)]
+Username = Annotated[str, msgspec.Meta(min_length=3, max_length=80)]
+Email = Annotated[str, msgspec.Meta(pattern='^[^@]+@[^@]+$', max_length=120)]
+
+
+class UserBody(msgspec.Struct):
+    username: Username
+    email: Email
+    password: Annotated[str, msgspec.Meta(min_length=1)]
+
+
+class LoginBody(msgspec.Struct):
+    password: str
+    username: Optional[str] = None
+    email: Optional[str] = None
+
+
+class RefreshBody(msgspec.Struct):
+    refresh_token: str
+
+
+class LogoutBody(msgspec.Struct):
+    refresh_token: Optional[str] = None
+
+
+class ProductBody(msgspec.Struct):
+    name: Annotated[str, msgspec.Meta(min_length=1, max_length=80)]
+    price: Price
+    stock: Stock
+
+
+class CartBody(msgspec.Struct):
+    user_id: Id
+    product_id: Id
+    quantity: Quantity
+
+
+class CartItemBody(msgspec.Struct):
+    cart_id: Id
+    product_id: Id
+    quantity: Quantity
+
+
+class OrderBody(msgspec.Struct):
+    user_id: Id
+    product_id: Id
+    quantity: Quantity
+
+
+class OrderItemBody(msgspec.Struct):
+    order_id: Id
+    product_id: Id
+    quantity: Quantity
+
+
+class QuantityBody(msgspec.Struct):
+    quantity: Quantity
+
+
+class ReviewBody(msgspec.Struct):
+    user_id: Id
+    product_id: Id
+    rating: Rating
+    comment: Optional[str] = None
+
+
+class ReviewUpdateBody(msgspec.Struct):
+    rating: Rating
+    comment: Optional[str] = None
+
+
+class SubRequest(msgspec.Struct):
+    path: str
+    method: str = 'GET'
+    body: Any = None
+    headers: Dict[str, str] = {}
+
+
+class BatchBody(msgspec.Struct):
+    requests: Annotated[List[SubRequest], msgspec.Meta(max_length=50)]
+    atomic: bool = False
+
+
+_decoders = {
+    schema: msgspec.json.Decoder(schema)
+    for schema in (
+        UserBody, LoginBody, RefreshBody, LogoutBody, ProductBody, CartBody, CartItemBody,
+        OrderBody, OrderItemBody, QuantityBody, ReviewBody, ReviewUpdateBody, BatchBody,
+    )
+}
+
+# msgspec reports "<what went wrong> - at `$.field`", or names a missing field
+_AT = re.compile(r' - at `\$\.?([^`]*)`$')
+_MISSING = re.compile(r'^Object missing required field `([^`]*)`')
+
+
+class InvalidBody(BadRequest):
+    # Flask-RESTful sends an HTTPException's `data` as the response body
+    def __init__(self, detail, field=None):
+        super().__init__()
+        self.data = {"error": "Invalid request body", "field": field, "detail": detail}
+
+
+def invalid_body(error):
+    message = str(error)
+    field = None
+    at = _AT.search(message)
+    if at:
+        message, field = message[:at.start()], at.group(1) or None
+    missing = _MISSING.match(message)
+    if missing:
+        # missing from a nested object: prefix the path to it
+        field = '.'.join(filter(None, (field, missing.group(1))))
+        message = 'Missing required field'
+    return InvalidBody(message, field)
+
+
+def decode(schema, data=None):
+    """Decode the request body (or `data`) into `schema`, raising InvalidBody on a mismatch."""
+    try:
+        return _decoders[schema].decode(request.get_data(cache=True) if data is None else data)
+    except msgspec.ValidationError as error:
+        raise invalid_body(error)
+    except msgspec.DecodeError:
+        raise InvalidBody("Request body is not valid JSON")
+
+
+def to_dict(body):
+    return msgspec.structs.asdict(body)
@@ -0,0 +1,306 @@
+# sharding.py
+# Optional horizontal sharding of user-owned rows.
+#
+# With DATABASE_SHARD_URLS set, carts, cart items, orders, order items and
+# reviews live in N shard databases, while users, products and bookkeeping
+# tables stay in the primary (catalog) database. Rows are placed by hashing
+# user_id into one of BUCKETS virtual buckets and the shard_map table assigns
+# buckets to shards, so rebalancing moves whole buckets instead of rehashing
+# every row. Cart items and order items follow their parent's bucket.
+#
+# Ids come from a global hi/lo sequence in the catalog and carry their bucket
+# in the low bits (id = seq * BUCKETS + bucket). That keeps them unique across
+# shards and lets a lookup by id go straight to the owning shard.
+#
+#   DATABASE_SHARD_URLS=sqlite:///shard-0.db,sqlite:///shard-1.db python sharding.py init
+#   python sharding.py import               # copy existing rows out of the primary
+#   python sharding.py rebalance [shards]   # after changing the shard URLs
+import heapq
+import itertools
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import delete, func, insert, select, update
+
+from models import db, ShardMapModel, IdSequenceModel
+
+BUCKETS = 1024
+# ids handed out per round trip to the catalog's sequence row
+ID_BLOCK = 100
+# how long a process trusts its cached copy of shard_map
+MAP_TTL = 5.0
+SEQUENCE = 'shard_rows'
+COPY_CHUNK = 500
+
+SHARDED_TABLES = ('cart', 'cart_item', 'order', 'order_item', 'review')
+# child table -> (parent id column, parent table)
+PARENTS = {'cart_item': ('cart_id', 'cart'), 'order_item': ('order_id', 'order')}
+
+
+def bucket_for_user(user_id):
+    # crc32 rather than hash() so every process agrees on the placement
+    return zlib.crc32(str(user_id).encode()) % BUCKETS
+
+
+def bucket_of(row_id):
+    return row_id % BUCKETS
+
+
+class StaleRow(Exception):
+    """The row exists but its version_id no longer matches."""
+
+
+class ShardedStore:
+    def __init__(self):
+        self.db = None
+        self.shards = []
+        self._map = None
+        self._map_loaded = 0.0
+        self._lock = threading.Lock()
+        self._next_seq = 0
+        self._seq_limit = 0
+        self._pool = None
+
+    def init_app(self, app, db):
+        self.db = db
+        self.shards = list(app.config.get('SQLALCHEMY_SHARDS', []))
+        if self.shards:
+            self._pool = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix='shard')
+
+    @property
+    def enabled(self):
+        return bool(self.shards)
+
+    def table(self, name):
+        return self.db.metadata.tables[name]
+
+    def engine(self, shard):
+        return self.db.engines[self.shards[shard]]
+
+    def create_all(self):
+        tables = [self.table(name) for name in SHARDED_TABLES]
+        for shard in range(len(self.shards)):
+            self.db.metadata.create_all(self.engine(shard), tables=tables)
+        with self.db.engine.begin() as connection:
+            mapped = connection.execute(select(func.count()).select_from(ShardMapModel.__table__)).scalar()
+            if not mapped:
+                connection.execute(insert(ShardMapModel.__table__), [
+                    {'bucket': bucket, 'shard': bucket % len(self.shards)} for bucket in range(BUCKETS)
+                ])
+            sequence = connection.execute(
+                select(IdSequenceModel.next_value).where(IdSequenceModel.name == SEQUENCE)
+            ).first()
+            if sequence is None:
+                connection.execute(insert(IdSequenceModel.__table__).values(name=SEQUENCE, next_value=1))
+        self._map = None
+
+    def bucket_map(self, refresh=False):
+        if refresh or self._map is None or time.monotonic() - self._map_loaded > MAP_TTL:
+            with self.db.engine.connect() as connection:
+                self._map = dict(connection.execute(select(ShardMapModel.bucket, ShardMapModel.shard)).all())
+            self._map_loaded = time.monotonic()
+        return self._map
+
+    def shard_for(self, row_id):
+        return self.bucket_map()[bucket_of(row_id)]
+
+    def next_id(self, bucket):
+        with self._lock:
+            if self._next_seq >= self._seq_limit:
+                sequence = IdSequenceModel.__table__
+                with self.db.engine.begin() as connection:
+                    connection.execute(
+                        update(sequence)
+                        .where(sequence.c.name == SEQUENCE)
+                        .values(next_value=sequence.c.next_value + ID_BLOCK)
+                    )
+                    limit = connection.execute(
+                        select(sequence.c.next_value).where(sequence.c.name == SEQUENCE)
+                    ).scalar_one()
+                self._next_seq, self._seq_limit = limit - ID_BLOCK, limit
+            seq = self._next_seq
+            self._next_seq += 1
+        return seq * BUCKETS + bucket
+
+    def bucket_for(self, name, values):
+        if name in PARENTS:
+            return bucket_of(values[PARENTS[name][0]])
+        return bucket_for_user(values['user_id'])
+
+    def _adjust(self, connection, adjust):
+        # (table, id, {column: delta}) applied to a parent row in the same
+        # transaction; children share their parent's bucket, so it is always
+        # on the same shard
+        if adjust is None:
+            return
+        name, row_id, deltas = adjust
+        table = self.table(name)
+        values = {column: table.c[column] + delta for column, delta in deltas.items()}
+        if 'version_id' in table.c:
+            values['version_id'] = table.c.version_id + 1
+        connection.execute(update(table).where(table.c.id == row_id).values(**values))
+
+    def insert(self, name, values, adjust=None):
+        table = self.table(name)
+        row = {'id': self.next_id(self.bucket_for(name, values))}
+        row.update(values)
+        if 'version_id' in table.c:
+            row['version_id'] = 1
+        with self.engine(self.shard_for(row['id'])).begin() as connection:
+            connection.execute(insert(table).values(**row))
+            self._adjust(connection, adjust)
+            # read it back for the server-side defaults
+            row = connection.execute(select(table).where(table.c.id == row['id'])).mappings().first()
+        return dict(row)
+
+    def get(self, name, row_id):
+        table = self.table(name)
+        with self.engine(self.shard_for(row_id)).connect() as connection:
+            row = connection.execute(select(table).where(table.c.id == row_id)).mappings().first()
+        return dict(row) if row else None
+
+    def update(self, name, row_id, values, version=None, adjust=None):
+        """Update a row, optionally only if it is still at `version`. Returns None when missing."""
+        table = self.table(name)
+        statement = update(table).where(table.c.id == row_id)
+        if 'version_id' in table.c:
+            values = dict(values, version_id=table.c.version_id + 1)
+            if version is not None:
+                statement = statement.where(table.c.version_id == version)
+        with self.engine(self.shard_for(row_id)).begin() as connection:
+            if connection.execute(statement.values(**values)).rowcount == 0:
+                if connection.execute(select(table.c.id).where(table.c.id == row_id)).first():
+                    raise StaleRow(row_id)
+                return None
+            self._adjust(connection, adjust)
+            row = connection.execute(select(table).where(table.c.id == row_id)).mappings().first()
+        return dict(row)
+
+    def delete(self, name, row_id, version=None, adjust=None, children=None):
+        """Delete a row, and with `children` (a child table) its child rows too.
+
+        Returns the deleted child rows, or None when the row is missing.
+        """
+        table = self.table(name)
+        statement = delete(table).where(table.c.id == row_id)
+        if version is not None and 'version_id' in table.c:
+            statement = statement.where(table.c.version_id == version)
+        removed = []
+        with self.engine(self.shard_for(row_id)).begin() as connection:
+            if connection.execute(statement).rowcount == 0:
+                if connection.execute(select(table.c.id).where(table.c.id == row_id)).first():
+                    raise StaleRow(row_id)
+                return None
+            self._adjust(connection, adjust)
+            if children:
+                # children share their parent's bucket, so they are on this shard
+                child = self.table(children)
+                parent = child.c[PARENTS[children][0]]
+                removed = [dict(row) for row in connection.execute(select(child).where(parent == row_id)).mappings()]
+                if removed:
+                    connection.execute(delete(child).where(child.c.id.in_([row['id'] for row in removed])))
+        return removed
+
+    def scatter_gather(self, name, where=(), limit=None):
+        """Query every shard in parallel and merge the results in id order."""
+        table = self.table(name)
+        statement = select(table).where(*where).order_by(table.c.id)
+        if limit is not None:
+            statement = statement.limit(limit)
+
+        def fetch(engine):
+            with engine.connect() as connection:
+                return [dict(row) for row in connection.execute(statement).mappings()]
+
+        # engines are looked up here because the pool threads have no app context
+        engines = [self.engine(shard) for shard in range(len(self.shards))]
+        merged = heapq.merge(*self._pool.map(fetch, engines), key=lambda row: row['id'])
+        return list(itertools.islice(merged, limit))
+
+    def rebalance(self, shard_count=None, log=print):
+        """Move buckets so bucket % shard_count picks their shard.
+
+        Run it with writers paused: a bucket is copied, switched over in
+        shard_map and only then removed from its old shard, but writes that
+        land on the old shard in between are not carried over.
+        """
+        shard_count = shard_count or len(self.shards)
+        current = self.bucket_map(refresh=True)
+        moves = [
+            (bucket, current[bucket], bucket % shard_count)
+            for bucket in range(BUCKETS)
+            if current[bucket] != bucket % shard_count
+        ]
+        for bucket, source, target in moves:
+            copied = 0
+            for name in SHARDED_TABLES:
+                table = self.table(name)
+                in_bucket = table.c.id % BUCKETS == bucket
+                with self.engine(source).connect() as connection:
+                    rows = [dict(row) for row in connection.execute(select(table).where(in_bucket)).mappings()]
+                with self.engine(target).begin() as connection:
+                    for start in range(0, len(rows), COPY_CHUNK):
+                        connection.execute(insert(table), rows[start:start + COPY_CHUNK])
+                copied += len(rows)
+            with self.db.engine.begin() as connection:
+                connection.execute(
+                    update(ShardMapModel.__table__).where(ShardMapModel.bucket == bucket).values(shard=target)
+                )
+            for name in SHARDED_TABLES:
+                table = self.table(name)
+                with self.engine(source).begin() as connection:
+                    connection.execute(delete(table).where(table.c.id % BUCKETS == bucket))
+            log("bucket %d: shard %d -> %d (%d rows)" % (bucket, source, target, copied))
+        self.bucket_map(refresh=True)
+        return len(moves)
+
+    def import_from_primary(self, log=print):
+        """Copy user-owned rows out of the primary, giving them shard-aware ids."""
+        def read(name):
+            # fully read before inserting: an open SQLite read would block
+            # the id sequence updates on the same file
+            with self.db.engine.connect() as source:
+                return [dict(row) for row in source.execute(select(self.table(name))).mappings()]
+
+        new_ids = {}
+        for name in ('cart', 'order', 'review'):
+            new_ids[name] = {}
+            for values in read(name):
+                old_id = values.pop('id')
+                new_ids[name][old_id] = self.insert(name, values)['id']
+            log("%s: %d rows" % (name, len(new_ids[name])))
+        for name, (parent_column, parent) in PARENTS.items():
+            count = 0
+            for values in read(name):
+                values.pop('id')
+                if values[parent_column] not in new_ids[parent]:
+                    continue
+                values[parent_column] = new_ids[parent][values[parent_column]]
+                self.insert(name, values)
+                count += 1
+            log("%s: %d rows" % (name, count))
+
+
+store = ShardedStore()
+
+
+if __name__ == '__main__':
+    import sys
+
+    from app import app
+    # the app configured the instance imported as `sharding`, not __main__'s
+    from sharding import store
+
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if not store.enabled or command not in ('init', 'import', 'rebalance'):
+        sys.exit("usage: DATABASE_SHARD_URLS=... python sharding.py init|import|rebalance [shards]")
+    with app.app_context():
+        if command == 'init':
+            store.create_all()
+        elif command == 'import':
+            store.import_from_primary()
+        else:
+            moved = store.rebalance(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+            print("%d buckets moved" % moved)
@@ -0,0 +1,142 @@
+# testing.py
+# Test harness for the API: a seeded template database built once per test
+# process and restored in place before every test.
+#
+# create_app() points the app at in-memory SQLite through the same
+# environment variables production uses, before app.py is imported. With
+# Flask-SQLAlchemy each in-memory bind is one shared StaticPool connection.
+# build() writes the schema and SEED_ROWS rows of every kind with bulk
+# inserts in one transaction, instead of seed.py's row-by-row commits, and
+# copies each database into a template with the sqlite3 backup API.
+# restore() copies the templates back over the live databases; at the seeded
+# size that takes well under a millisecond.
+#
+# Restoring pages, rather than wrapping each test in a SAVEPOINT, keeps the
+# code that opens its own connection or commits on purpose (atomic batches,
+# the job queue, archive moves, purges) running exactly as in production.
+#
+# Each pytest-xdist worker is its own process with its own in-memory
+# databases and its own template, so parallel runs need no coordination:
+#   cd server && pytest -n auto
+import os
+import sqlite3
+
+# low cost factor, so login and password changes stay cheap in tests
+BCRYPT_LOG_ROUNDS = 4
+SEED_ROWS = 100
+PASSWORD = 'password'
+PRICE = 10.0
+STOCK = 100
+# auth_headers(ADMIN_USER_ID) passes the /admin checks
+ADMIN_USER_ID = 1
+
+
+def create_app():
+    """Import app.py against in-memory databases and return the Flask app."""
+    # set, not setdefault: a DATABASE_URL left in the shell must never be the
+    # database the suite wipes before every test
+    os.environ['DATABASE_URL'] = 'sqlite://'
+    os.environ['ARCHIVE_DATABASE_URL'] = 'sqlite://'
+    os.environ['DATABASE_REPLICA_URLS'] = ''
+    os.environ['DATABASE_SHARD_URLS'] = ''
+    os.environ.setdefault('SECRET_KEY', 'test-secret')
+    os.environ['ADMIN_USER_IDS'] = str(ADMIN_USER_ID)
+
+    # the modules come through app.py, so the harness sees exactly the
+    # modules (and job handlers) a production process has
+    from app import app, archive, purge
+    from models import get_bcrypt
+
+    app.config['TESTING'] = True
+    app.config['BCRYPT_LOG_ROUNDS'] = BCRYPT_LOG_ROUNDS
+    get_bcrypt().init_app(app)
+    # the pauses leave room for foreground writers, of which a test has none
+    archive.CHUNK_PAUSE = 0
+    purge.BATCH_PAUSE = 0
+    return app
+
+
+def seed(connection, rows=SEED_ROWS):
+    # the shape seed.py produces: per n one user, product, cart, cart item,
+    # order with one item, and review, all sharing the id n
+    from sqlalchemy import insert
+
+    from inventory import slot_rows
+    from models import get_bcrypt, UserModel, ProductModel, ProductStockSlotModel, cartModel, cartItemModel, OrderModel, OrderItemModel, ReviewModel
+
+    password_hash = get_bcrypt().generate_password_hash(PASSWORD).decode('utf-8')
+    ids = range(1, rows + 1)
+    for model, values in (
+        (UserModel, lambda n: {'username': 'user%d' % n, 'email': 'user%d@example.com' % n, 'password_hash': password_hash}),
+        (ProductModel, lambda n: {'name': 'Shoe %d' % n, 'price': PRICE, 'stock': STOCK}),
+        (cartModel, lambda n: {'user_id': n, 'product_id': n, 'quantity': 1}),
+        (cartItemModel, lambda n: {'cart_id': n, 'product_id': n, 'quantity': 1}),
+        (OrderModel, lambda n: {'user_id': n, 'product_id': n, 'quantity': 1, 'item_count': 1, 'total': PRICE}),
+        (OrderItemModel, lambda n: {'order_id': n, 'product_id': n, 'quantity': 1, 'unit_price': PRICE}),
+        (ReviewModel, lambda n: {'user_id': n, 'product_id': n, 'rating': 5, 'comment': 'Great product!'}),
+    ):
+        connection.execute(insert(model), [dict(values(n), id=n) for n in ids])
+    # bulk inserts skip the mapper hook that gives new products their slots
+    connection.execute(insert(ProductStockSlotModel), [row for n in ids for row in slot_rows(n, STOCK)])
+
+
+class TemplateDatabases:
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.templates = {}
+
+    def build(self, rows=SEED_ROWS):
+        import archive
+
+        with self.app.app_context():
+            self.db.create_all()
+            archive.ensure_schema()
+            with self.db.engine.begin() as connection:
+                seed(connection, rows)
+            for key, engine in self.db.engines.items():
+                template = sqlite3.connect(':memory:', check_same_thread=False)
+                self._copy(engine, lambda live: live.backup(template))
+                self.templates[key] = template
+        return self
+
+    def _copy(self, engine, copy):
+        connection = engine.raw_connection()
+        try:
+            copy(connection.driver_connection)
+        finally:
+            connection.close()
+
+    def restore(self):
+        """Put every database back to the seeded state."""
+        from auth import tokens
+
+        with self.app.app_context():
+            # the backup needs the live connection outside a transaction
+            self.db.session.remove()
+            for key, template in self.templates.items():
+                self._copy(self.db.engines[key], lambda live: template.backup(live))
+        tokens._revoked.clear()
+        tokens._revoked_users.clear()
+
+    def close(self):
+        for template in self.templates.values():
+            template.close()
+        self.templates = {}
+
+
+def auth_headers(user_id):
+    """Authorization header for `user_id`, as /login would issue it."""
+    from auth import tokens
+
+    return {'Authorization': 'Bearer ' + tokens.issue(user_id)}
+
+
+def run_jobs(limit=100):
+    """Run queued jobs that are due, in this thread. Returns how many ran."""
+    from jobs import run_one
+
+    ran = 0
+    while ran < limit and run_one('test'):
+        ran += 1
+    return ran
@@ -0,0 +1,51 @@
+# Reads across the hot and archive databases, see archive.py.
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from jobs import enqueue
+from models import OrderModel, OrderItemModel
+
+ORDERS = OrderModel.__table__
+
+
+def archive_old_orders(database, run_jobs, order_ids):
+    old = datetime.utcnow() - timedelta(days=365)
+    database.session.execute(update(ORDERS).where(ORDERS.c.id.in_(order_ids)).values(created_at=old))
+    enqueue('archive_orders', older_than_days=180)
+    database.session.commit()
+    run_jobs()
+
+
+def test_archived_orders_are_still_readable(client, database, run_jobs):
+    archive_old_orders(database, run_jobs, [1, 2, 3])
+    assert database.session.get(OrderModel, 2) is None
+    assert database.session.get(OrderItemModel, 2) is None
+
+    response = client.get('/orders/2')
+    assert response.status_code == 200
+    assert response.json['user_id'] == 2
+    assert 'ETag' not in response.headers
+    assert client.get('/order_items/2').json['order_id'] == 2
+    # hot orders keep their ETag
+    assert client.get('/orders/4').headers['ETag']
+
+
+def test_listings_merge_both_sides_in_order(client, database, run_jobs):
+    archive_old_orders(database, run_jobs, [1, 50, 100])
+    orders = client.get('/orders').json
+    assert [order['id'] for order in orders] == list(range(1, 101))
+    items = client.get('/order_items').json
+    assert [item['id'] for item in items] == list(range(1, 101))
+
+
+def test_archived_orders_are_read_only(client, database, run_jobs):
+    archive_old_orders(database, run_jobs, [1])
+    assert client.put('/orders/1', json={'quantity': 2}, headers={'If-Match': '*'}).status_code == 404
+    assert client.get('/orders/1').json['quantity'] == 1
+
+
+def test_unknown_order_is_404(client, database, run_jobs):
+    archive_old_orders(database, run_jobs, [1])
+    assert client.get('/orders/1000').status_code == 404
+    assert client.get('/order_items/1000').status_code == 404
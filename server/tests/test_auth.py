@@ -0,0 +1,88 @@
+# Bearer tokens and the admin checks, see auth.py.
+import pytest
+
+from testing import ADMIN_USER_ID, PASSWORD
+
+
+def login(client, username='user2', password=PASSWORD):
+    return client.post('/login', json={'username': username, 'password': password})
+
+
+def bearer(token):
+    return {'Authorization': 'Bearer ' + token}
+
+
+def test_login_issues_a_token_pair(client):
+    response = login(client)
+    assert response.status_code == 200
+    assert response.json['token_type'] == 'Bearer'
+    assert client.get('/users/2', headers=bearer(response.json['access_token'])).json['username'] == 'user2'
+
+
+def test_login_by_email(client):
+    assert client.post('/login', json={'email': 'user2@example.com', 'password': PASSWORD}).status_code == 200
+
+
+@pytest.mark.parametrize('username, password', [('user2', 'wrong'), ('nobody', PASSWORD)])
+def test_bad_credentials_are_401(client, username, password):
+    assert login(client, username, password).status_code == 401
+
+
+def test_missing_or_bad_token_is_401(client):
+    assert client.get('/users/2').status_code == 401
+    assert client.get('/users/2', headers=bearer('garbage')).status_code == 401
+    token = login(client).json['access_token']
+    assert client.get('/users/2', headers=bearer(token[:-2] + 'xx')).status_code == 401
+
+
+def test_refresh_token_is_not_an_access_token(client):
+    refresh = login(client).json['refresh_token']
+    assert client.get('/users/2', headers=bearer(refresh)).status_code == 401
+
+
+def test_other_users_are_403(client, auth_headers):
+    assert client.get('/users/3', headers=auth_headers(2)).status_code == 403
+    assert client.delete('/users/3', headers=auth_headers(2)).status_code == 403
+
+
+def test_refresh_rotates(client):
+    refresh = login(client).json['refresh_token']
+    response = client.post('/token/refresh', json={'refresh_token': refresh})
+    assert response.status_code == 200
+    assert client.get('/users/2', headers=bearer(response.json['access_token'])).status_code == 200
+    # spent
+    assert client.post('/token/refresh', json={'refresh_token': refresh}).status_code == 401
+
+
+def test_logout_revokes_both_tokens(client):
+    tokens = login(client).json
+    response = client.post('/logout', json={'refresh_token': tokens['refresh_token']}, headers=bearer(tokens['access_token']))
+    assert response.status_code == 200
+    assert client.get('/users/2', headers=bearer(tokens['access_token'])).status_code == 401
+    assert client.post('/token/refresh', json={'refresh_token': tokens['refresh_token']}).status_code == 401
+
+
+def test_password_change_revokes_older_tokens(client):
+    old = login(client).json['access_token']
+    body = {'username': 'user2', 'email': 'user2@example.com', 'password': 'new-password'}
+    assert client.put('/users/2', json=body, headers=bearer(old)).status_code == 200
+    assert client.get('/users/2', headers=bearer(old)).status_code == 401
+    assert login(client, password='new-password').status_code == 200
+
+
+@pytest.mark.parametrize('path', ['/users', '/admin/jobs', '/admin/purges', '/admin/maintenance'])
+def test_admin_only(client, auth_headers, path):
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers=auth_headers(2)).status_code == 403
+    assert client.get(path, headers=auth_headers(ADMIN_USER_ID)).status_code in (200, 404)
+
+
+def test_user_list_for_admins(client, auth_headers):
+    users = client.get('/users', headers=auth_headers(ADMIN_USER_ID)).json
+    assert len(users) == 100
+
+
+def test_sign_up_stays_open(client):
+    body = {'username': 'newbie', 'email': 'newbie@example.com', 'password': 'password123'}
+    assert client.post('/users', json=body).status_code == 201
+    assert login(client, 'newbie', 'password123').status_code == 200
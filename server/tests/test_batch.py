@@ -0,0 +1,56 @@
+# POST /batch, plain and atomic.
+from models import JobModel, OrderModel
+
+
+def stock(client, product_id):
+    return client.get('/products/%d/stock?exact=1' % product_id).json['stock']
+
+
+def test_references_earlier_responses(client):
+    response = client.post('/batch', json={'atomic': True, 'requests': [
+        {'method': 'POST', 'path': '/orders', 'body': {'user_id': 1, 'product_id': 2, 'quantity': 1}},
+        {'method': 'POST', 'path': '/order_items', 'body': {'order_id': '$0.id', 'product_id': 2, 'quantity': 1}},
+        {'method': 'GET', 'path': '/orders/$0.id'},
+    ]})
+    assert response.status_code == 200
+    created, item, order = response.json['responses']
+    assert item['body']['order_id'] == created['body']['id']
+    assert order['body']['item_count'] == 1
+    assert created['headers']['ETag']
+
+
+def test_atomic_batch_rolls_back_on_failure(client, database):
+    orders = OrderModel.query.count()
+    jobs = JobModel.query.count()
+    response = client.post('/batch', json={'atomic': True, 'requests': [
+        {'method': 'POST', 'path': '/orders', 'body': {'user_id': 1, 'product_id': 2, 'quantity': 5}},
+        {'method': 'PUT', 'path': '/carts/1', 'body': {'quantity': 4}, 'headers': {'If-Match': '*'}},
+        {'method': 'POST', 'path': '/orders', 'body': {'user_id': 1, 'product_id': 3, 'quantity': 1000}},
+    ]})
+    assert response.status_code == 409
+    assert response.json['failed'] == 2
+
+    assert OrderModel.query.count() == orders
+    # the order confirmation job went with the order
+    assert JobModel.query.count() == jobs
+    assert stock(client, 2) == 100
+    assert client.get('/carts/1').json['quantity'] == 1
+
+
+def test_plain_batch_keeps_earlier_writes(client, database):
+    orders = OrderModel.query.count()
+    response = client.post('/batch', json={'requests': [
+        {'method': 'POST', 'path': '/orders', 'body': {'user_id': 1, 'product_id': 2, 'quantity': 5}},
+        {'method': 'POST', 'path': '/orders', 'body': {'user_id': 1, 'product_id': 3, 'quantity': 1000}},
+    ]})
+    assert response.status_code == 200
+    assert [r['status'] for r in response.json['responses']] == [201, 409]
+    assert OrderModel.query.count() == orders + 1
+    assert stock(client, 2) == 95
+
+
+def test_bad_reference_is_400(client):
+    response = client.post('/batch', json={'requests': [
+        {'method': 'GET', 'path': '/orders/$1.id'},
+    ]})
+    assert response.json['responses'][0]['status'] == 400
@@ -0,0 +1,116 @@
+# The /changes feed: plain reads, long-polls and SSE, see changes.py.
+import json
+import time
+
+import pytest
+
+from changes import log_change
+
+
+@pytest.fixture
+def feed(app, database):
+    from app import ChangeFeedResource
+
+    return ChangeFeedResource
+
+
+def hold_every_slot(feed):
+    held = 0
+    while feed.waiters.acquire(blocking=False):
+        held += 1
+    return held
+
+
+def free_slots(feed):
+    held = hold_every_slot(feed)
+    for _ in range(held):
+        feed.waiters.release()
+    return held
+
+
+def test_writes_are_listed_in_order(client):
+    assert client.get('/changes?since=0').json == {'changes': [], 'last_seq': 0}
+    etag = client.get('/carts/1').headers['ETag']
+    assert client.put('/carts/1', json={'quantity': 2}, headers={'If-Match': etag}).status_code == 200
+    assert client.delete('/reviews/1', headers={'If-Match': '*'}).status_code == 200
+
+    feed = client.get('/changes?since=0').json
+    assert [(c['table'], c['id'], c['op']) for c in feed['changes']] == [('cart', 1, 'update'), ('review', 1, 'delete')]
+    assert feed['changes'][0]['version'] == 2
+    assert feed['last_seq'] == feed['changes'][-1]['seq']
+    assert client.get('/changes?since=%d' % feed['last_seq']).json == {'changes': [], 'last_seq': feed['last_seq']}
+
+
+def test_limit_pages_through_the_feed(client, database):
+    for row_id in range(1, 6):
+        log_change('product', row_id, 'update', 2)
+    database.session.commit()
+    first = client.get('/changes?since=0&limit=2').json
+    assert [c['id'] for c in first['changes']] == [1, 2]
+    rest = client.get('/changes?since=%d' % first['last_seq']).json
+    assert [c['id'] for c in rest['changes']] == [3, 4, 5]
+
+
+def test_long_poll_returns_a_change_committed_while_waiting(client, feed, monkeypatch):
+    import app as app_module
+
+    def commit_during_wait(timeout):
+        log_change('product', 7, 'update', 2)
+        app_module.db.session.commit()
+
+    monkeypatch.setattr(app_module, 'wait_for_changes', commit_during_wait)
+    slots = free_slots(feed)
+
+    response = client.get('/changes?since=0&wait=5')
+    assert [(c['table'], c['id']) for c in response.json['changes']] == [('product', 7)]
+    # the slot is handed back once the poll is over
+    assert free_slots(feed) == slots
+
+
+def test_long_poll_times_out_empty(client):
+    started = time.monotonic()
+    response = client.get('/changes?since=0&wait=0.2')
+    assert time.monotonic() - started >= 0.2
+    assert response.json == {'changes': [], 'last_seq': 0}
+
+
+def test_full_waiters_are_503(client, database, feed):
+    held = hold_every_slot(feed)
+    try:
+        for path in ('/changes?since=0&wait=5', '/changes?stream=1'):
+            response = client.get(path)
+            assert response.status_code == 503, path
+            assert response.headers['Retry-After'] == '1'
+        # reads that find changes never wait, so they never need a slot
+        log_change('product', 1, 'update', 2)
+        database.session.commit()
+        assert client.get('/changes?since=0&wait=5').status_code == 200
+    finally:
+        for _ in range(held):
+            feed.waiters.release()
+
+
+def test_stream_sends_events_and_frees_its_slot(client, database, feed):
+    slots = free_slots(feed)
+    for row_id in (1, 2):
+        log_change('product', row_id, 'update', 2)
+    database.session.commit()
+
+    response = client.get('/changes', headers={'Accept': 'text/event-stream', 'Last-Event-ID': '1'}, buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    event = next(response.response).decode()
+    response.close()
+    lines = event.split('\n')
+    assert lines[:2] == ['id: 2', 'event: change']
+    assert json.loads(lines[2][len('data: '):])['id'] == 2
+    assert free_slots(feed) == slots
+
+
+def test_idle_stream_sends_heartbeats(client, feed, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(feed, 'HEARTBEAT', 0)
+    monkeypatch.setattr(app_module, 'wait_for_changes', lambda timeout: None)
+    response = client.get('/changes?stream=1', buffered=False)
+    assert next(response.response) == b': keep-alive\n\n'
+    response.close()
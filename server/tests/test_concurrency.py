@@ -0,0 +1,63 @@
+# Optimistic concurrency: versioned rows need If-Match on PUT/DELETE.
+import pytest
+
+PRODUCT = {'name': 'Shoe 1', 'price': 12.5, 'stock': 100}
+
+
+@pytest.mark.parametrize('method, path, body', [
+    ('put', '/products/1', PRODUCT),
+    ('delete', '/products/1', None),
+    ('put', '/carts/1', {'quantity': 2}),
+    ('put', '/orders/1', {'quantity': 2}),
+    ('delete', '/orders/1', None),
+    ('put', '/reviews/1', {'rating': 3, 'comment': 'ok'}),
+])
+def test_write_without_if_match_is_428(client, method, path, body):
+    response = getattr(client, method)(path, json=body)
+    assert response.status_code == 428
+
+
+def test_get_returns_etag(client):
+    response = client.get('/products/1')
+    assert response.headers['ETag'] == '"1-1"'
+
+
+def test_put_with_current_etag_bumps_version(client):
+    etag = client.get('/products/1').headers['ETag']
+    response = client.put('/products/1', json=PRODUCT, headers={'If-Match': etag})
+    assert response.status_code == 200
+    assert response.json['price'] == 12.5
+    assert response.headers['ETag'] == '"1-2"'
+
+
+def test_stale_etag_is_412_with_current_etag(client):
+    etag = client.get('/products/1').headers['ETag']
+    assert client.put('/products/1', json=PRODUCT, headers={'If-Match': etag}).status_code == 200
+
+    response = client.put('/products/1', json=dict(PRODUCT, price=20.0), headers={'If-Match': etag})
+    assert response.status_code == 412
+    assert response.headers['ETag'] == '"1-2"'
+    assert client.get('/products/1').json['price'] == 12.5
+
+
+def test_wildcard_matches(client):
+    assert client.put('/carts/1', json={'quantity': 2}, headers={'If-Match': '*'}).status_code == 200
+    assert client.get('/carts/1').json['quantity'] == 2
+
+
+def test_weak_etag_does_not_match(client):
+    etag = client.get('/carts/1').headers['ETag']
+    response = client.put('/carts/1', json={'quantity': 3}, headers={'If-Match': 'W/' + etag})
+    assert response.status_code == 412
+    assert client.put('/carts/1', json={'quantity': 3}, headers={'If-Match': 'W/"x", ' + etag}).status_code == 200
+
+
+def test_order_item_writes_move_the_order_version(client):
+    etag = client.get('/orders/1').headers['ETag']
+    response = client.post('/order_items', json={'order_id': 1, 'product_id': 2, 'quantity': 2})
+    assert response.status_code == 201
+
+    order = client.get('/orders/1')
+    assert order.json['item_count'] == 3
+    assert order.json['total'] == 30.0
+    assert client.put('/orders/1', json={'quantity': 2}, headers={'If-Match': etag}).status_code == 412
@@ -0,0 +1,113 @@
+# Stock reservation on the order paths, see inventory.py.
+import inventory
+from models import ProductStockSlotModel
+
+
+def stock(client, product_id):
+    return client.get('/products/%d/stock?exact=1' % product_id).json['stock']
+
+
+def test_order_reserves_stock(client):
+    response = client.post('/orders', json={'user_id': 1, 'product_id': 2, 'quantity': 30})
+    assert response.status_code == 201
+    assert stock(client, 2) == 70
+
+
+def test_order_beyond_stock_is_409(client):
+    response = client.post('/orders', json={'user_id': 1, 'product_id': 2, 'quantity': 101})
+    assert response.status_code == 409
+    assert stock(client, 2) == 100
+
+
+def test_reservation_spans_slots(client):
+    # more than any one slot holds, so the locked fallback takes from several
+    assert client.post('/orders', json={'user_id': 1, 'product_id': 2, 'quantity': 95}).status_code == 201
+    assert stock(client, 2) == 5
+    assert client.post('/orders', json={'user_id': 1, 'product_id': 2, 'quantity': 6}).status_code == 409
+    assert client.post('/orders', json={'user_id': 1, 'product_id': 2, 'quantity': 5}).status_code == 201
+    assert stock(client, 2) == 0
+
+
+def test_order_update_and_delete_move_the_difference(client):
+    assert client.put('/orders/1', json={'quantity': 11}, headers={'If-Match': '*'}).status_code == 200
+    assert stock(client, 1) == 90
+    assert client.put('/orders/1', json={'quantity': 200}, headers={'If-Match': '*'}).status_code == 409
+    assert client.put('/orders/1', json={'quantity': 4}, headers={'If-Match': '*'}).status_code == 200
+    assert stock(client, 1) == 97
+    # the order's 4 units and the 1 of its seeded item come back
+    assert client.delete('/orders/1', headers={'If-Match': '*'}).status_code == 200
+    assert stock(client, 1) == 102
+
+
+def test_rejected_order_update_keeps_stock(client):
+    response = client.put('/orders/1', json={'quantity': 20}, headers={'If-Match': '"1-9"'})
+    assert response.status_code == 412
+    assert stock(client, 1) == 100
+
+
+def test_order_items_reserve_and_release(client):
+    response = client.post('/order_items', json={'order_id': 2, 'product_id': 3, 'quantity': 5})
+    assert response.status_code == 201
+    item_id = response.json['id']
+    assert stock(client, 3) == 95
+
+    assert client.post('/order_items', json={'order_id': 2, 'product_id': 3, 'quantity': 96}).status_code == 409
+    assert client.put('/order_items/%d' % item_id, json={'quantity': 2}).status_code == 200
+    assert stock(client, 3) == 98
+    assert client.delete('/order_items/%d' % item_id).status_code == 200
+    assert stock(client, 3) == 100
+
+
+def test_product_update_resets_stock(client):
+    body = {'name': 'Shoe 1', 'price': 10.0, 'stock': 7}
+    assert client.put('/products/1', json=body, headers={'If-Match': '*'}).status_code == 200
+    assert stock(client, 1) == 7
+    assert client.get('/products/1/stock').json['stock'] == 7
+
+
+def test_rebalance_evens_slots_and_refreshes_total(client, database):
+    assert client.post('/orders', json={'user_id': 1, 'product_id': 4, 'quantity': 40}).status_code == 201
+    inventory.rebalance()
+
+    slots = [slot.quantity for slot in ProductStockSlotModel.query.filter_by(product_id=4)]
+    assert sum(slots) == 60
+    assert max(slots) - min(slots) <= 1
+    assert client.get('/products/4/stock').json['stock'] == 60
+
+
+def test_worker_start_schedules_rebalance(app, database):
+    from jobs import WorkerPool
+    from models import JobModel
+
+    for _ in range(2):
+        pool = WorkerPool(app, threads=1)
+        pool.start()
+        pool.stop()
+    # one chain, whether or not a worker already ran and re-queued it
+    pending = JobModel.query.filter(
+        JobModel.name == 'rebalance_inventory', JobModel.status.in_(('queued', 'running'))
+    )
+    assert pending.count() == 1
+
+
+def test_order_delete_releases_its_items(client, database):
+    from models import OrderItemModel
+
+    assert client.post('/orders', json={'user_id': 1, 'product_id': 5, 'quantity': 3}).status_code == 201
+    order_id = client.get('/orders').json[-1]['id']
+    assert client.post('/order_items', json={'order_id': order_id, 'product_id': 5, 'quantity': 10}).status_code == 201
+    assert client.post('/order_items', json={'order_id': order_id, 'product_id': 6, 'quantity': 2}).status_code == 201
+    assert stock(client, 5) == 87
+
+    assert client.delete('/orders/%d' % order_id, headers={'If-Match': '*'}).status_code == 200
+    assert stock(client, 5) == 100
+    assert stock(client, 6) == 100
+    assert OrderItemModel.query.filter_by(order_id=order_id).count() == 0
+
+
+def test_stale_order_delete_keeps_items_and_stock(client, database):
+    from models import OrderItemModel
+
+    assert client.delete('/orders/1', headers={'If-Match': '"1-9"'}).status_code == 412
+    assert stock(client, 1) == 100
+    assert OrderItemModel.query.filter_by(order_id=1).count() == 1
@@ -0,0 +1,142 @@
+# The durable job queue, see jobs.py.
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from jobs import BACKOFF_BASE, BACKOFF_MAX, LEASE_TIMEOUT, WorkerPool, backoff, enqueue, job, requeue_stale
+from models import db, JobModel
+
+SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENQUEUED = re.compile(r"""\benqueue\(\s*['"](\w+)['"]""")
+
+
+def enqueued_names():
+    names = set()
+    for name in os.listdir(SERVER):
+        if name.endswith('.py'):
+            with open(os.path.join(SERVER, name)) as source:
+                names.update(ENQUEUED.findall(source.read()))
+    return names
+
+
+def test_every_enqueued_job_has_a_handler():
+    # a fresh interpreter, so only what app.py itself imports is registered
+    env = dict(os.environ, DATABASE_URL='sqlite://', ARCHIVE_DATABASE_URL='sqlite://', SECRET_KEY='test-secret')
+    registered = subprocess.run(
+        [sys.executable, '-c', 'from app import app; import jobs; print(" ".join(jobs._handlers))'],
+        cwd=SERVER, env=env, capture_output=True, text=True, check=True,
+    ).stdout.split()
+    names = enqueued_names()
+    assert 'purge' in names
+    assert names <= set(registered)
+
+
+calls = []
+
+
+@job('test_flaky', max_attempts=2)
+def flaky(fail=True):
+    calls.append(fail)
+    if fail:
+        raise RuntimeError('boom')
+
+
+def queued(name, **payload):
+    new_job = enqueue(name, **payload)
+    db.session.commit()
+    return new_job.id
+
+
+def test_enqueue_commits_with_the_caller(database):
+    enqueue('test_flaky', fail=False)
+    database.session.rollback()
+    assert JobModel.query.filter_by(name='test_flaky').count() == 0
+
+    enqueue('test_flaky', fail=False)
+    database.session.commit()
+    assert JobModel.query.filter_by(name='test_flaky').count() == 1
+
+
+def test_unknown_job_is_refused(database):
+    with pytest.raises(KeyError):
+        enqueue('no_such_job')
+
+
+def test_successful_job_is_done(database, run_jobs):
+    job_id = queued('test_flaky', fail=False)
+    assert run_jobs() == 1
+    done = database.session.get(JobModel, job_id)
+    assert (done.status, done.attempts, done.locked_by) == ('done', 1, None)
+    assert done.finished_at is not None
+
+
+def test_failed_job_backs_off_then_gives_up(database, run_jobs):
+    job_id = queued('test_flaky')
+    before = datetime.utcnow()
+    assert run_jobs() == 1
+    retry = database.session.get(JobModel, job_id)
+    assert retry.status == 'queued'
+    assert retry.last_error == 'RuntimeError: boom'
+    # attempt 1 waits 1-2 s, so it is not due yet
+    assert retry.run_at > before
+    assert run_jobs() == 0
+
+    retry.run_at = datetime.utcnow()
+    database.session.commit()
+    assert run_jobs() == 1
+    failed = database.session.get(JobModel, job_id)
+    assert (failed.status, failed.attempts) == ('failed', 2)
+    assert failed.finished_at is not None
+
+
+def test_backoff_grows_and_is_capped():
+    for attempts in range(1, 15):
+        delay = backoff(attempts)
+        ceiling = min(BACKOFF_BASE ** attempts, BACKOFF_MAX)
+        assert ceiling / 2 <= delay <= ceiling
+    assert backoff(50) <= BACKOFF_MAX
+
+
+def test_jobs_run_in_due_order(database, run_jobs):
+    del calls[:]
+    later = enqueue('test_flaky', fail=False)
+    later.run_at = datetime.utcnow() - timedelta(seconds=1)
+    earlier = enqueue('test_flaky', fail=None)
+    earlier.run_at = datetime.utcnow() - timedelta(seconds=2)
+    enqueue('test_flaky', delay=3600, fail=True)
+    database.session.commit()
+    assert run_jobs() == 2
+    assert calls == [None, False]
+
+
+def test_requeue_stale_only_takes_expired_leases(database):
+    stale, fresh = queued('test_flaky'), queued('test_flaky')
+    now = datetime.utcnow()
+    for job_id, locked_at in ((stale, now - LEASE_TIMEOUT - timedelta(seconds=1)), (fresh, now)):
+        running = database.session.get(JobModel, job_id)
+        running.status, running.locked_by, running.locked_at = 'running', 'dead-worker', locked_at
+    database.session.commit()
+
+    assert requeue_stale() == 1
+    assert database.session.get(JobModel, stale).status == 'queued'
+    assert database.session.get(JobModel, stale).locked_by is None
+    assert database.session.get(JobModel, fresh).status == 'running'
+
+
+def test_workers_sweep_for_stale_jobs_while_running(app, database, monkeypatch):
+    import jobs
+
+    sweeps = []
+    monkeypatch.setattr(jobs, 'REQUEUE_INTERVAL', 0.05)
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.01)
+    monkeypatch.setattr(jobs, 'requeue_stale', lambda: sweeps.append(1))
+    pool = WorkerPool(app, threads=1)
+    pool.start()
+    time.sleep(0.3)
+    pool.stop()
+    assert len(sweeps) >= 3
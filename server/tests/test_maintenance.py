@@ -0,0 +1,106 @@
+# Online upkeep of a file SQLite database, see maintenance.py.
+import os
+import sqlite3
+
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+
+import maintenance as maintenance_module
+from maintenance import Maintenance
+from testing import ADMIN_USER_ID
+
+ROWS = 2000
+
+
+@pytest.fixture
+def upkeep(tmp_path):
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + str(tmp_path / 'data.db')
+    app.config['BACKUP_DIR'] = str(tmp_path / 'backups')
+    db = SQLAlchemy(app)
+    tasks = Maintenance()
+    tasks.init_app(app, db)
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(text('CREATE TABLE item (id INTEGER PRIMARY KEY, body TEXT)'))
+            connection.execute(text('CREATE INDEX ix_item_body ON item (body)'))
+            connection.execute(text('INSERT INTO item (body) VALUES (:body)'), [{'body': 'x' * 500}] * ROWS)
+    yield tasks
+    with app.app_context():
+        db.engine.dispose()
+
+
+def test_memory_databases_have_no_tasks(app, database):
+    # the suite's app runs on in-memory SQLite
+    assert not maintenance_module.maintenance.enabled
+
+
+def test_file_database_runs_in_wal_mode(upkeep, tmp_path):
+    assert upkeep.enabled
+    assert upkeep.run('checkpoint')['mode'] == 'PASSIVE'
+    assert (tmp_path / 'data.db-wal').exists()
+
+
+def test_optimize_analyzes_once(upkeep):
+    first = upkeep.run('optimize')
+    assert first['full_analyze'] is True
+    assert first['stat_rows'] >= 1
+    assert upkeep.run('optimize')['full_analyze'] is False
+
+
+def test_incremental_vacuum_needs_enabling(upkeep):
+    assert upkeep.run('incremental_vacuum') == {'skipped': 'auto_vacuum is not INCREMENTAL'}
+
+    upkeep.enable_incremental_vacuum()
+    with upkeep.app.app_context(), upkeep.db.engine.begin() as connection:
+        connection.execute(text('DELETE FROM item'))
+    result = upkeep.run('incremental_vacuum')
+    assert result['pages_freed'] > 0
+    assert result['free_pages_left'] == 0
+
+
+def test_checkpoint_truncates_a_large_wal(upkeep, monkeypatch):
+    monkeypatch.setattr(maintenance_module, 'WAL_SIZE_CAP', 0)
+    result = upkeep.run('checkpoint')
+    assert result['mode'] == 'TRUNCATE'
+    assert result['wal_bytes_after'] == 0
+
+
+def test_backup_is_a_readable_copy(upkeep, tmp_path, monkeypatch):
+    monkeypatch.setattr(maintenance_module, 'BACKUP_KEEP', 2)
+    paths = [upkeep.run('backup')['path'] for _ in range(3)]
+
+    kept = sorted(path.name for path in (tmp_path / 'backups').iterdir())
+    assert kept == sorted(os.path.basename(path) for path in paths[1:])
+    copy = sqlite3.connect(paths[-1])
+    try:
+        assert copy.execute('SELECT count(*) FROM item').fetchone()[0] == ROWS
+    finally:
+        copy.close()
+
+
+def test_failures_are_recorded(upkeep, monkeypatch):
+    def broken():
+        raise RuntimeError('disk full')
+
+    monkeypatch.setitem(upkeep.tasks, 'backup', (broken, maintenance_module.BACKUP_INTERVAL))
+    assert upkeep.run('backup') is None
+    stats = upkeep.status()['backup']
+    assert (stats['runs'], stats['failures'], stats['last_error']) == (1, 1, 'RuntimeError: disk full')
+
+    assert upkeep.run('optimize') is not None
+    assert upkeep.status()['optimize']['last_error'] is None
+
+
+def test_admin_status(client, auth_headers, upkeep, monkeypatch):
+    import app as app_module
+
+    assert client.get('/admin/maintenance', headers=auth_headers(ADMIN_USER_ID)).status_code == 404
+    monkeypatch.setattr(app_module, 'maintenance', upkeep)
+    upkeep.run('checkpoint')
+    status = client.get('/admin/maintenance', headers=auth_headers(ADMIN_USER_ID)).json
+    assert set(status) == {'optimize', 'incremental_vacuum', 'checkpoint', 'backup'}
+    assert status['checkpoint']['runs'] == 1
+    assert status['backup']['runs'] == 0
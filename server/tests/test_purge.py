@@ -0,0 +1,76 @@
+# DELETE of users and products: tombstone at once, purge in the background.
+from models import (
+    UserModel, ProductModel, ProductStockSlotModel, cartModel, OrderModel, OrderItemModel, ReviewModel, PurgeModel,
+)
+
+
+def test_user_delete_hides_then_purges(client, database, auth_headers, run_jobs):
+    headers = auth_headers(3)
+    response = client.delete('/users/3', headers=headers)
+    assert response.status_code == 202
+    assert response.headers['Location'] == '/admin/purges/%d' % response.json['purge']['id']
+
+    # gone for reads and logins before the purge has run
+    assert client.get('/users/3', headers=auth_headers(3)).status_code == 404
+    assert client.post('/login', json={'username': 'user3', 'password': 'password'}).status_code == 401
+    assert client.get('/users/3', headers=headers).status_code == 401
+
+    run_jobs()
+    purge = client.get(response.headers['Location'], headers=auth_headers(1)).json
+    assert purge['status'] == 'done'
+    assert purge['rows_deleted'] == 6
+
+    assert database.session.get(UserModel, 3) is None
+    assert cartModel.query.filter_by(user_id=3).count() == 0
+    assert OrderModel.query.filter_by(user_id=3).count() == 0
+    assert OrderItemModel.query.filter_by(order_id=3).count() == 0
+    assert ReviewModel.query.filter_by(user_id=3).count() == 0
+    assert database.session.get(UserModel, 4) is not None
+
+
+def test_product_purge_updates_orders_that_stay(client, database, run_jobs):
+    assert client.post('/order_items', json={'order_id': 1, 'product_id': 7, 'quantity': 2}).status_code == 201
+
+    response = client.delete('/products/7', headers={'If-Match': '*'})
+    assert response.status_code == 202
+    assert client.get('/products/7').status_code == 404
+    assert all(product['id'] != 7 for product in client.get('/products').json)
+    # nothing can be ordered while the purge runs
+    assert client.post('/orders', json={'user_id': 1, 'product_id': 7, 'quantity': 1}).status_code == 404
+
+    run_jobs()
+    assert database.session.get(PurgeModel, response.json['purge']['id']).status == 'done'
+    assert database.session.get(ProductModel, 7) is None
+    assert ProductStockSlotModel.query.filter_by(product_id=7).count() == 0
+    assert database.session.get(OrderModel, 7) is None
+    order = client.get('/orders/1').json
+    assert order['item_count'] == 1
+    assert order['total'] == 10.0
+
+
+def test_purge_runs_in_several_jobs(database, auth_headers, client, run_jobs):
+    import purge
+
+    client.delete('/users/5', headers=auth_headers(5))
+    record = PurgeModel.query.filter_by(row_id=5).one()
+    # a zero budget hands the worker back after every batch
+    purge.purge(record.id, batch_size=1, run_seconds=0)
+    database.session.refresh(record)
+    assert record.status == 'running'
+    run_jobs()
+    database.session.refresh(record)
+    assert record.status == 'done'
+    assert database.session.get(UserModel, 5) is None
+
+
+def test_new_rows_for_tombstoned_rows_are_404(client, auth_headers):
+    assert client.delete('/users/8', headers=auth_headers(8)).status_code == 202
+    assert client.delete('/products/9', headers={'If-Match': '*'}).status_code == 202
+    for path, body in (
+        ('/carts', {'user_id': 8, 'product_id': 1, 'quantity': 1}),
+        ('/cart_items', {'cart_id': 1, 'product_id': 9, 'quantity': 1}),
+        ('/orders', {'user_id': 8, 'product_id': 1, 'quantity': 1}),
+        ('/order_items', {'order_id': 1, 'product_id': 9, 'quantity': 1}),
+        ('/reviews', {'user_id': 1, 'product_id': 9, 'rating': 4}),
+    ):
+        assert client.post(path, json=body).status_code == 404, path
@@ -0,0 +1,96 @@
+# "Frequently bought together" lists, see recommendations.py.
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, update
+
+import recommendations
+from jobs import schedule_recurring
+from models import JobModel, OrderModel, OrderItemModel, ProductPairModel, RecommendationModel, WatermarkModel
+
+ORDERS = OrderModel.__table__
+
+
+def settle_orders(database):
+    settled = datetime.utcnow() - recommendations.SETTLE_TIME - timedelta(minutes=1)
+    database.session.execute(update(ORDERS).values(created_at=settled))
+    database.session.commit()
+
+
+def add_items(database, *pairs):
+    database.session.execute(insert(OrderItemModel), [
+        {'order_id': order_id, 'product_id': product_id, 'quantity': 1, 'unit_price': 10.0}
+        for order_id, product_id in pairs
+    ])
+    database.session.commit()
+
+
+def pair_counts(database):
+    return {(pair.product_id, pair.other_id): pair.count for pair in ProductPairModel.query}
+
+
+def test_refresh_counts_pairs_both_ways(database):
+    # order 1 holds products 1, 2, 3 and order 2 holds 2, 3
+    add_items(database, (1, 2), (1, 3), (2, 3))
+    settle_orders(database)
+    assert recommendations.refresh(chunk_size=7) == 100
+
+    assert pair_counts(database) == {
+        (1, 2): 1, (2, 1): 1, (1, 3): 1, (3, 1): 1, (2, 3): 2, (3, 2): 2,
+    }
+    ranked = RecommendationModel.query.filter_by(product_id=2).order_by(RecommendationModel.rank).all()
+    assert [(row.recommended_id, row.score) for row in ranked] == [(3, 2), (1, 1)]
+    assert database.session.get(WatermarkModel, recommendations.WATERMARK).value == 100
+
+
+def test_refresh_skips_orders_that_may_still_change(database):
+    add_items(database, (1, 2), (2, 3))
+    database.session.execute(update(ORDERS).where(ORDERS.c.id == 1).values(
+        created_at=datetime.utcnow() - recommendations.SETTLE_TIME * 2,
+    ))
+    database.session.commit()
+    assert recommendations.refresh() == 1
+    assert pair_counts(database) == {(1, 2): 1, (2, 1): 1}
+
+
+def test_refresh_adds_to_earlier_counts(database):
+    add_items(database, (1, 2))
+    settle_orders(database)
+    recommendations.refresh()
+    # items added to an order that was already processed are not counted
+    add_items(database, (3, 1), (3, 2))
+    database.session.execute(insert(OrderModel), [
+        {'id': 101, 'user_id': 1, 'product_id': 1, 'quantity': 1, 'item_count': 2, 'total': 20.0},
+    ])
+    add_items(database, (101, 1), (101, 2))
+    settle_orders(database)
+    assert recommendations.refresh() == 101
+    assert pair_counts(database)[(1, 2)] == 2
+
+
+def test_endpoint_lists_recommendations(client, database):
+    add_items(database, (1, 2), (1, 3), (2, 3))
+    settle_orders(database)
+    recommendations.refresh()
+
+    response = client.get('/products/2/recommendations')
+    assert response.status_code == 200
+    assert [(row['id'], row['score']) for row in response.json] == [(3, 2), (1, 1)]
+    assert response.json[0]['name'] == 'Shoe 3'
+    assert [row['id'] for row in client.get('/products/2/recommendations?limit=1').json] == [3]
+    assert client.get('/products/50/recommendations').json == []
+    assert client.get('/products/1000/recommendations').status_code == 404
+
+
+def test_repeating_refresh_queues_its_next_run(database):
+    before = datetime.utcnow()
+    recommendations.refresh(repeat=True)
+    next_run = JobModel.query.filter_by(name='refresh_recommendations', status='queued').one()
+    assert next_run.run_at >= before + timedelta(seconds=recommendations.REFRESH_INTERVAL)
+
+
+def test_worker_pools_start_the_refresh_once(database):
+    schedule_recurring()
+    schedule_recurring()
+    queued = JobModel.query.filter_by(name='refresh_recommendations', status='queued').all()
+    assert len(queued) == 1
+    assert queued[0].to_dict()['payload'] == {'repeat': True}
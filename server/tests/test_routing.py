@@ -0,0 +1,107 @@
+# Read-replica routing, see routing.py. The suite's app has no replicas, so
+# these tests run a small app of their own on the same `db`, with a primary
+# and two in-memory replicas that each name their product after themselves.
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+
+import routing
+from models import db, ChangeModel, ProductModel
+from routing import ReplicaRouter
+
+REPLICAS = ['replica_0', 'replica_1']
+CLIENT = {'X-Client-Id': 'client-a'}
+OTHER_CLIENT = {'X-Client-Id': 'client-b'}
+
+
+@pytest.fixture
+def replicated(monkeypatch):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_BINDS'] = {key: 'sqlite://' for key in REPLICAS}
+    app.config['SQLALCHEMY_REPLICAS'] = REPLICAS
+    app.config['READ_YOUR_WRITES_SECONDS'] = 5.0
+    db.init_app(app)
+    router = ReplicaRouter()
+    router.init_app(app, db)
+    # RoutingSession routes through the module's router
+    monkeypatch.setattr(routing, 'router', router)
+
+    @app.get('/products/1')
+    def read():
+        return {'name': db.session.get(ProductModel, 1).name}
+
+    @app.put('/products/1')
+    def write():
+        product = db.session.get(ProductModel, 1)
+        # a write request reads from the primary too
+        product.price = 20.0
+        db.session.commit()
+        return {'name': product.name}
+
+    with app.app_context():
+        for key, engine in [('primary', db.engine)] + [(key, db.engines[key]) for key in REPLICAS]:
+            tables = [ProductModel.__table__] + ([ChangeModel.__table__] if key == 'primary' else [])
+            db.metadata.create_all(engine, tables=tables)
+            with engine.begin() as connection:
+                connection.execute(insert(ProductModel), [{'id': 1, 'name': key, 'price': 10.0, 'stock': 1}])
+    yield SimpleNamespace(app=app, client=app.test_client(), router=router)
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def read(replicated, headers=None):
+    return replicated.client.get('/products/1', headers=headers).json['name']
+
+
+def test_reads_go_to_the_replicas_in_turn(replicated):
+    assert {read(replicated) for _ in range(4)} == set(REPLICAS)
+
+
+def test_writes_go_to_the_primary(replicated):
+    assert replicated.client.put('/products/1', headers=CLIENT).json['name'] == 'primary'
+
+
+def test_writers_read_their_writes(replicated):
+    replicated.client.put('/products/1', headers=CLIENT)
+    assert read(replicated, CLIENT) == 'primary'
+    assert read(replicated, OTHER_CLIENT) in REPLICAS
+
+    # once the window has passed the writer reads from replicas again
+    replicated.router._last_write['client-a'] -= replicated.router.window
+    assert read(replicated, CLIENT) in REPLICAS
+
+
+def test_failed_writes_keep_reads_on_replicas(replicated):
+    replicated.client.post('/products/1', headers=CLIENT)
+    assert read(replicated, CLIENT) in REPLICAS
+
+
+def test_unhealthy_replicas_are_skipped(replicated, monkeypatch):
+    router = replicated.router
+    router.health_interval = 0
+
+    def refuse():
+        raise OperationalError('SELECT 1', {}, Exception('unable to open database file'))
+
+    with replicated.app.app_context(), monkeypatch.context() as patch:
+        patch.setattr(db.engines['replica_0'], 'connect', refuse)
+        assert {read(replicated) for _ in range(4)} == {'replica_1'}
+        assert router.status() == {'replica_0': False, 'replica_1': True}
+
+        patch.setattr(db.engines['replica_1'], 'connect', refuse)
+        assert read(replicated) == 'primary'
+
+    # the next successful check puts them back
+    assert {read(replicated) for _ in range(4)} == set(REPLICAS)
+
+
+def test_health_is_cached_between_checks(replicated):
+    router = replicated.router
+    router.health_interval = 60
+    router._on_error('replica_0')(SimpleNamespace(is_disconnect=True, connection=None))
+    assert {read(replicated) for _ in range(4)} == {'replica_1'}
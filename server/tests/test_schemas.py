@@ -0,0 +1,41 @@
+# Request bodies that do not match their schema are 400s naming the field, see schemas.py.
+import pytest
+
+
+def invalid(field, detail):
+    return {'error': 'Invalid request body', 'field': field, 'detail': detail}
+
+
+@pytest.mark.parametrize('path, body, field, detail', [
+    ('/orders', {'user_id': 1, 'product_id': 1, 'quantity': 0}, 'quantity', 'Expected `int` >= 1'),
+    ('/orders', {'user_id': 1, 'product_id': 1, 'quantity': 'two'}, 'quantity', 'Expected `int`, got `str`'),
+    ('/orders', {'user_id': 1, 'product_id': 1}, 'quantity', 'Missing required field'),
+    ('/products', {'name': 'Boot', 'price': 0, 'stock': 1}, 'price', 'Expected `float` > 0.0'),
+    ('/reviews', {'user_id': 1, 'product_id': 1, 'rating': 6}, 'rating', 'Expected `int` <= 5'),
+    ('/users', {'username': 'ab', 'email': 'ab@example.com', 'password': 'x'}, 'username', 'Expected `str` of length >= 3'),
+    ('/users', {'username': 'abc', 'email': 'nope', 'password': 'x'}, 'email', "Expected `str` matching regex '^[^@]+@[^@]+$'"),
+    ('/batch', {'requests': [{'method': 'GET'}]}, 'requests[0].path', 'Missing required field'),
+])
+def test_bad_field_is_400(client, path, body, field, detail):
+    response = client.post(path, json=body)
+    assert response.status_code == 400
+    assert response.json == invalid(field, detail)
+
+
+@pytest.mark.parametrize('data', [b'{"user_id": 1,', b'', b'not json'])
+def test_malformed_json_is_400(client, data):
+    response = client.post('/orders', data=data, content_type='application/json')
+    assert response.status_code == 400
+    assert response.json == invalid(None, 'Request body is not valid JSON')
+
+
+def test_body_must_be_an_object(client):
+    response = client.post('/orders', json=[1, 2, 3])
+    assert response.status_code == 400
+    assert response.json == invalid(None, 'Expected `object`, got `array`')
+
+
+def test_bad_body_writes_nothing(client):
+    before = len(client.get('/orders').json)
+    client.post('/orders', json={'user_id': 1, 'product_id': 1, 'quantity': -1})
+    assert len(client.get('/orders').json) == before
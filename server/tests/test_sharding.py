@@ -0,0 +1,152 @@
+# Sharded user-owned rows, see sharding.py. The suite's app is unsharded, so
+# these tests mount the Sharded* resources on a small app of their own with a
+# file primary and two file shards, seeded and imported the way
+# `sharding.py import` moves an existing database.
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+from flask_restful import Api
+
+import testing
+from models import db
+from sharding import BUCKETS, ShardedStore, bucket_for_user, bucket_of
+
+SHARDS = ['shard_0', 'shard_1']
+ROWS = 10
+
+
+@pytest.fixture
+def sharded(app, tmp_path, monkeypatch):
+    import app as app_module
+
+    sharded_app = Flask(__name__)
+    sharded_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///%s' % (tmp_path / 'primary.db')
+    sharded_app.config['SQLALCHEMY_BINDS'] = {key: 'sqlite:///%s' % (tmp_path / (key + '.db')) for key in SHARDS}
+    sharded_app.config['SQLALCHEMY_SHARDS'] = SHARDS
+    db.init_app(sharded_app)
+    store = ShardedStore()
+    store.init_app(sharded_app, db)
+    # the resources write through the module's store
+    monkeypatch.setattr(app_module, 'store', store)
+    api = Api(sharded_app)
+    for resource, path in (
+        (app_module.ShardedOrderResource, '/orders'),
+        (app_module.ShardedOrderByIdResource, '/orders/<int:order_id>'),
+        (app_module.ShardedOrderItemResource, '/order_items'),
+        (app_module.ShardedOrderItemByIdResource, '/order_items/<int:order_item_id>'),
+        (app_module.ShardedReviewResource, '/reviews'),
+        (app_module.ProductStockResource, '/products/<int:product_id>/stock'),
+    ):
+        api.add_resource(resource, path)
+
+    with sharded_app.app_context():
+        db.create_all(bind_key=None)
+        with db.engine.begin() as connection:
+            testing.seed(connection, rows=ROWS)
+        store.create_all()
+        store.import_from_primary(log=lambda message: None)
+        yield SimpleNamespace(client=sharded_app.test_client(), store=store)
+        store._pool.shutdown()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def stock(sharded, product_id):
+    return sharded.client.get('/products/%d/stock?exact=1' % product_id).json['stock']
+
+
+def rows_by_shard(store, name):
+    table = store.table(name)
+    placed = {}
+    for shard in range(len(store.shards)):
+        with store.engine(shard).connect() as connection:
+            placed[shard] = sorted(row.id for row in connection.execute(table.select()))
+    return placed
+
+
+def test_rows_live_on_their_users_shard(sharded):
+    orders = sharded.client.get('/orders').json
+    assert sorted(order['user_id'] for order in orders) == list(range(1, ROWS + 1))
+    # scatter-gather merges the shards back into id order
+    assert [order['id'] for order in orders] == sorted(order['id'] for order in orders)
+
+    placed = rows_by_shard(sharded.store, 'order')
+    assert all(placed.values())
+    for order in orders:
+        assert bucket_of(order['id']) == bucket_for_user(order['user_id'])
+        assert order['id'] in placed[sharded.store.shard_for(order['id'])]
+
+
+def test_children_follow_their_parent(sharded):
+    for item in sharded.store.scatter_gather('order_item'):
+        assert bucket_of(item['id']) == bucket_of(item['order_id'])
+
+
+def test_order_crud(sharded):
+    client = sharded.client
+    response = client.post('/orders', json={'user_id': 3, 'product_id': 2, 'quantity': 4})
+    assert response.status_code == 201
+    order_id = response.json['id']
+    assert stock(sharded, 2) == testing.STOCK - 4
+
+    etag = client.get('/orders/%d' % order_id).headers['ETag']
+    response = client.put('/orders/%d' % order_id, json={'quantity': 6}, headers={'If-Match': etag})
+    assert response.status_code == 200
+    assert response.json['quantity'] == 6
+    assert stock(sharded, 2) == testing.STOCK - 6
+    # the old ETag is stale now, and the stock stays put
+    assert client.put('/orders/%d' % order_id, json={'quantity': 1}, headers={'If-Match': etag}).status_code == 412
+    assert client.delete('/orders/%d' % order_id, headers={'If-Match': etag}).status_code == 412
+    assert stock(sharded, 2) == testing.STOCK - 6
+
+    assert client.delete('/orders/%d' % order_id, headers={'If-Match': '*'}).status_code == 200
+    assert client.get('/orders/%d' % order_id).status_code == 404
+    assert stock(sharded, 2) == testing.STOCK
+
+
+def test_order_delete_releases_its_items(sharded):
+    client = sharded.client
+    order_id = client.post('/orders', json={'user_id': 1, 'product_id': 1, 'quantity': 3}).json['id']
+    response = client.post('/order_items', json={'order_id': order_id, 'product_id': 2, 'quantity': 5})
+    assert response.status_code == 201
+    assert bucket_of(response.json['id']) == bucket_of(order_id)
+    order = client.get('/orders/%d' % order_id).json
+    assert (order['item_count'], order['total']) == (5, 5 * testing.PRICE)
+
+    assert client.delete('/orders/%d' % order_id, headers={'If-Match': '*'}).status_code == 200
+    assert (stock(sharded, 1), stock(sharded, 2)) == (testing.STOCK, testing.STOCK)
+    items = sharded.store.table('order_item').c
+    assert sharded.store.scatter_gather('order_item', where=[items.order_id == order_id]) == []
+
+
+def test_missing_rows_are_404(sharded):
+    client = sharded.client
+    assert client.get('/orders/%d' % (BUCKETS * 1000 + 1)).status_code == 404
+    assert client.post('/orders', json={'user_id': 1000, 'product_id': 1, 'quantity': 1}).status_code == 404
+    assert client.post('/order_items', json={'order_id': BUCKETS * 1000 + 1, 'product_id': 1, 'quantity': 1}).status_code == 404
+
+
+def test_scatter_gather_filters_and_limits(sharded):
+    reviews = sharded.store.table('review').c
+    assert [row['user_id'] for row in sharded.store.scatter_gather('review', where=[reviews.user_id == 3])] == [3]
+    every = sharded.store.scatter_gather('review')
+    assert sharded.store.scatter_gather('review', limit=3) == every[:3]
+
+
+def test_rebalance_moves_whole_buckets(sharded):
+    store = sharded.store
+    before = sharded.client.get('/orders').json
+
+    moved = store.rebalance(1, log=lambda message: None)
+    assert moved == BUCKETS // 2
+    placed = rows_by_shard(store, 'order')
+    assert placed[1] == [] and len(placed[0]) == ROWS
+    assert sharded.client.get('/orders').json == before
+
+    assert store.rebalance(2, log=lambda message: None) == BUCKETS // 2
+    assert all(rows_by_shard(store, 'order').values())
+    assert sharded.client.get('/orders').json == before
+    # writes after a rebalance land where the map now says
+    order_id = sharded.client.post('/orders', json={'user_id': 5, 'product_id': 1, 'quantity': 1}).json['id']
+    assert order_id in rows_by_shard(store, 'order')[store.shard_for(order_id)]